@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+'''Compare the cost of aggregating mproc reports in the parent process.
+
+    $ python benchmarks/bench_aggregation.py [report amount]
+
+"manager" replays what the plugin used to do for every report (a locked
+Manager proxy list per category, a proxy append of the testcase xml and a
+locked proxy counter increment), "stream" sends compact report records in
+batches over a pipe and rebuilds the reports in the parent.
+'''
+import sys
+import time
+import multiprocessing
+
+from _pytest.runner import TestReport
+
+import pytest_concurrent
+
+
+def make_reports(amount):
+    return [TestReport('test_bench.py::test_%d' % i, ('test_bench.py', i, 'test_%d' % i),
+                       {'test_%d' % i: 1}, 'passed', None, 'call', duration=0.001)
+            for i in range(amount)]
+
+
+def bench_manager(reports):
+    manager = multiprocessing.Manager()
+    stats = manager.dict()
+    xmlstats = manager.dict(passed=0)
+    nodereports = manager.list()
+    lock = multiprocessing.Lock()
+
+    start = time.time()
+    for report in reports:
+        with lock:
+            if stats.get('passed') is None:
+                stats['passed'] = manager.list()
+            category = stats.get('passed')
+            category.append(report)
+            stats['passed'] = category
+        nodereports.append('<testcase name="%s"/>' % report.nodeid)
+        with lock:
+            xmlstats['passed'] += 1
+    elapsed = time.time() - start
+    manager.shutdown()
+    return elapsed
+
+
+def _send_reports(reports, writer):
+    stream = pytest_concurrent.ReportStream(writer)
+    for index, report in enumerate(reports):
+        stream.add(index, [report])
+    stream.close()
+
+
+def bench_stream(reports):
+    reader, writer = multiprocessing.Pipe(duplex=False)
+    start = time.time()
+    proc = multiprocessing.Process(target=_send_reports, args=(reports, writer))
+    proc.start()
+    writer.close()
+
+    stats = {}
+    while True:
+        try:
+            batch, _ = reader.recv()
+        except EOFError:
+            break
+        for index, records in batch:
+            for record in records:
+                stats.setdefault('passed', []).append(pytest_concurrent._record_to_report(record))
+    proc.join()
+    return time.time() - start
+
+
+def main():
+    amount = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    reports = make_reports(amount)
+    for name, bench in (('manager', bench_manager), ('stream', bench_stream)):
+        elapsed = bench(reports)
+        print('%-8s %8.3fs total %8.3fs per 10k reports' % (name, elapsed, elapsed * 10000 / amount))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+'''Compare the memory held by the dispatcher for large amounts of items.
+
+    $ python benchmarks/bench_dispatch_memory.py [item amounts...]
+
+"eager" hands every batch to the executor up front (what the plugin used to
+do), "bounded" keeps DISPATCH_FACTOR batches per worker in flight. The
+synthetic items do nothing, so the peak is what dispatching itself allocates
+(futures, work items, closures and the graph bookkeeping).
+'''
+import sys
+import time
+import tracemalloc
+import collections
+import concurrent.futures
+
+import pytest_concurrent
+
+WORKERS = 8
+
+
+class SyntheticItem(object):
+
+    def __init__(self, index):
+        self.nodeid = 'test_synthetic.py::test_%d' % index
+
+    def get_marker(self, name):
+        return None
+
+
+def run(items, limit):
+    plan = collections.OrderedDict(ungrouped=[[item] for item in items])
+    tracemalloc.start()
+    start = time.time()
+    graph = pytest_concurrent.GroupGraph(plan, {})
+    with concurrent.futures.ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        running = {}
+        while not graph.done:
+            for group, batch, nextitem in graph.dispatchable(None if limit is None else limit - len(running)):
+                running[executor.submit(len, batch)] = batch
+            finished, _ = concurrent.futures.wait(list(running), return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                for item in running.pop(future):
+                    graph.finish(item)
+    elapsed = time.time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, elapsed
+
+
+def main():
+    amounts = [int(amount) for amount in sys.argv[1:]] or [10000, 100000, 1000000]
+    for amount in amounts:
+        items = [SyntheticItem(index) for index in range(amount)]
+        for name, limit in (('eager', None), ('bounded', pytest_concurrent.DISPATCH_FACTOR * WORKERS)):
+            peak, elapsed = run(items, limit)
+            print('%8d items %-8s peak %9.1f MiB %8.2fs' % (amount, name, peak / 1024.0 / 1024.0, elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+'''Compare the JUnit XML writers of mproc mode for large amounts of testcases.
+
+    $ python benchmarks/bench_junitxml.py [testcase amount]
+
+"tree" keeps every serialized testcase until the end of the session and
+builds one testsuite from them (what the plugin used to do), "stream" writes
+each testcase to the file as it finishes and fixes up the counts at close.
+'''
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+
+import py
+from _pytest.junitxml import Junit
+
+import pytest_concurrent
+
+COUNTS = dict(errors=0, failures=0, skips=0)
+
+
+def testcases(amount):
+    for index in range(amount):
+        yield Junit.testcase(classname='test_bench', name='test_%d' % index, file='test_bench.py',
+                             line=index, time=0.001).unicode(indent=0)
+
+
+def bench_tree(amount, path):
+    node_reports = []
+    for testcase in testcases(amount):
+        node_reports.append(testcase)
+    with open(path, 'w', encoding='utf-8') as logfile:
+        logfile.write('<?xml version="1.0" encoding="utf-8"?>')
+        logfile.write(Junit.testsuite([py.xml.raw(report) for report in node_reports], name='pytest',
+                                      tests=amount, time='0.000', **COUNTS).unicode(indent=0))
+
+
+def bench_stream(amount, path):
+    stream = pytest_concurrent.JunitStream(path, 'pytest')
+    for testcase in testcases(amount):
+        stream.add(testcase)
+    stream.close('', tests=amount, time='0.000', **COUNTS)
+
+
+def main():
+    amount = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    directory = tempfile.mkdtemp()
+    for name, bench in (('tree', bench_tree), ('stream', bench_stream)):
+        path = os.path.join(directory, '%s.xml' % name)
+        tracemalloc.start()
+        start = time.time()
+        bench(amount, path)
+        elapsed = time.time() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('%d testcases %-6s peak %8.1f MiB %7.2fs %8.1f MiB written' % (
+            amount, name, peak / 1024.0 / 1024.0, elapsed, os.path.getsize(path) / 1024.0 / 1024.0))
+        os.remove(path)
+    os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+'''Compare the concurrent modes on synthetic suites and record the results.
+
+    $ python benchmarks/bench_modes.py [--sizes 100,1000] [--suites cpu,sleep,fixture,tiny,skewed]
+          [--modes serial,mthread,mproc,asyncnet] [--workers 2,4] [--repeat 1]
+          [--output bench_modes.json] [--baseline previous.json] [-- extra pytest args]
+
+Every suite is generated once per size (modules of up to MODULE_SIZE tests):
+
+  cpu      every test spins on the CPU for about CPU_WORK seconds
+  sleep    every test sleeps SLEEP_WORK seconds, like a test waiting on I/O
+  fixture  a module scoped fixture sleeps FIXTURE_WORK seconds, function scoped ones build some data
+  tiny     every test passes right away, which is the overhead of the plugin and pytest
+  skewed   every test sleeps for a Pareto distributed duration of SLEEP_WORK on average
+
+and run with pytest in a subprocess for every mode and --concworkers value
+(serial runs without --concmode, once). Each run records its wall time, the
+peak RSS of pytest and all its worker processes, the parallel efficiency and
+the time the workers were not busy with test phases per test (both from
+--conctrace). The results and the machine they were measured on are written
+to a JSON file, --baseline compares the wall times with an earlier one.
+'''
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import psutil
+
+import pytest_concurrent
+
+MODULE_SIZE = 100
+CPU_WORK = 0.005
+SLEEP_WORK = 0.01
+FIXTURE_WORK = 0.2
+
+# how often the RSS of a run is sampled
+RSS_INTERVAL = 0.05
+
+SUITES = {
+    'cpu': ('''
+import time
+
+def spin():
+    deadline = time.process_time() + %(cpu)r
+    while time.process_time() < deadline:
+        pass
+''', '''
+def test_%(index)d():
+    spin()
+'''),
+    'sleep': ('''
+import time
+''', '''
+def test_%(index)d():
+    time.sleep(%(sleep)r)
+'''),
+    'fixture': ('''
+import time
+import pytest
+
+@pytest.fixture(scope='module')
+def dataset():
+    time.sleep(%(fixture)r)
+    return list(range(10000))
+
+@pytest.fixture
+def rows(dataset):
+    return [str(row) for row in dataset[:1000]]
+''', '''
+def test_%(index)d(rows):
+    assert len(rows) == 1000
+'''),
+    'tiny': ('', '''
+def test_%(index)d():
+    pass
+'''),
+    'skewed': ('''
+import time
+''', '''
+def test_%(index)d():
+    time.sleep(%(duration)r)
+'''),
+}
+
+
+def make_suite(path, suite, size):
+    header, test = SUITES[suite]
+    rng = random.Random(size)
+    values = {'cpu': CPU_WORK, 'sleep': SLEEP_WORK, 'fixture': FIXTURE_WORK}
+    for module in range(0, size, MODULE_SIZE):
+        with open(os.path.join(path, 'test_%s_%d.py' % (suite, module)), 'w') as test_file:
+            test_file.write(header % values)
+            for index in range(module, min(size, module + MODULE_SIZE)):
+                # a mean of 1 for the shape 3
+                values['duration'] = round(SLEEP_WORK * rng.paretovariate(3) * 2 / 3, 6)
+                values['index'] = index
+                test_file.write(test % values)
+
+
+def tree_rss(process):
+    '''RSS of a process and all its children'''
+    total = 0
+    for member in [process] + process.children(recursive=True):
+        try:
+            total += member.memory_info().rss
+        except psutil.Error:
+            pass
+    return total
+
+
+def parse_trace_summary(output):
+    '''(workers, busy seconds, efficiency) from the --conctrace summary of a run'''
+    for line in output.splitlines():
+        if ' workers busy ' in line and 'parallel efficiency' in line:
+            words = line.split()
+            return int(words[0]), float(words[3].rstrip('s')), float(words[-1].rstrip('%')) / 100
+    return None, None, None
+
+
+def run(path, mode, workers, extra_args):
+    trace = os.path.join(path, 'trace.json')
+    args = [sys.executable, '-m', 'pytest', '-q', '-p', 'no:cacheprovider', '--conctrace=%s' % trace]
+    if mode != 'serial':
+        args += ['--concmode=%s' % mode, '--concworkers=%d' % workers]
+    with tempfile.TemporaryFile() as output:
+        start = time.time()
+        proc = subprocess.Popen(args + extra_args, cwd=path, stdout=output, stderr=subprocess.STDOUT)
+        process = psutil.Process(proc.pid)
+        peak = 0
+        while proc.poll() is None:
+            peak = max(peak, tree_rss(process))
+            time.sleep(RSS_INTERVAL)
+        wall = time.time() - start
+        output.seek(0)
+        text = output.read().decode('utf-8', 'replace')
+    traced, busy, efficiency = parse_trace_summary(text)
+    return {'exitcode': proc.returncode, 'wall': round(wall, 4), 'peak_rss': peak,
+            'workers_traced': traced, 'busy': busy, 'efficiency': efficiency}
+
+
+def available(mode):
+    '''Why a mode cannot run here, None if it can'''
+    if mode == 'asyncnet':
+        try:
+            import gevent  # noqa: F401
+        except ImportError:
+            return 'gevent is not installed'
+    if mode in ('mproc', 'asyncnet') and sys.platform == 'win32':
+        return 'does not run on windows'
+    return None
+
+
+def machine():
+    return {
+        'plugin_version': getattr(pytest_concurrent, '__version__', None) or _distribution_version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': psutil.cpu_count(),
+        'memory': psutil.virtual_memory().total,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def _distribution_version():
+    try:
+        import pkg_resources
+        return pkg_resources.get_distribution('pytest-concurrent').version
+    except Exception:
+        return None
+
+
+def key(result):
+    return (result['suite'], result['size'], result['mode'], result['workers'])
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as baseline_file:
+        baseline = dict((key(result), result) for result in json.load(baseline_file)['results'])
+    for result in results:
+        before = baseline.get(key(result))
+        if before is None or not before.get('wall') or not result.get('wall'):
+            continue
+        print('%-8s %7d %-9s %3s workers: %8.3fs -> %8.3fs (%+.0f%%)' % (
+            result['suite'], result['size'], result['mode'], result['workers'] or '-',
+            before['wall'], result['wall'], 100.0 * (result['wall'] - before['wall']) / before['wall']))
+
+
+def main():
+    argv = sys.argv[1:]
+    extra_args = argv[argv.index('--') + 1:] if '--' in argv else []
+    argv = argv[:argv.index('--')] if '--' in argv else argv
+    parser = argparse.ArgumentParser(description='Compare the concurrent modes on synthetic suites.')
+    parser.add_argument('--sizes', default='100,1000', help='test amounts of every suite (up to 100000)')
+    parser.add_argument('--suites', default=','.join(sorted(SUITES)))
+    parser.add_argument('--modes', default='serial,mthread,mproc,asyncnet')
+    parser.add_argument('--workers', default='2,4', help='--concworkers values of the concurrent modes')
+    parser.add_argument('--repeat', type=int, default=1, help='runs of every configuration, the median is kept')
+    parser.add_argument('--output', default='bench_modes.json')
+    parser.add_argument('--baseline', help='results of an earlier run to compare the wall times with')
+    options = parser.parse_args(argv)
+
+    results = []
+    for suite in options.suites.split(','):
+        for size in [int(size) for size in options.sizes.split(',')]:
+            path = tempfile.mkdtemp(prefix='bench_%s_%d_' % (suite, size))
+            make_suite(path, suite, size)
+            for mode in options.modes.split(','):
+                for workers in ([None] if mode == 'serial' else [int(count) for count in options.workers.split(',')]):
+                    result = {'suite': suite, 'size': size, 'mode': mode, 'workers': workers}
+                    skipped = available(mode)
+                    if skipped:
+                        result['skipped'] = skipped
+                    else:
+                        runs = sorted((run(path, mode, workers, extra_args) for _ in range(options.repeat)),
+                                      key=lambda measured: measured['wall'])
+                        result.update(runs[len(runs) // 2])
+                        # worker time which was not spent in test phases, per test
+                        if result['busy'] is not None and result['workers_traced']:
+                            idle = result['wall'] * result['workers_traced'] - result['busy']
+                            result['overhead_per_test'] = round(max(0.0, idle) / size, 6)
+                    results.append(result)
+                    print(json.dumps(result, sort_keys=True))
+
+    with open(options.output, 'w') as output:
+        json.dump({'machine': machine(), 'pytest_args': extra_args, 'results': results}, output, indent=1, sort_keys=True)
+    print('results written to %s' % options.output)
+    if options.baseline:
+        compare(results, options.baseline)
+
+
+if __name__ == '__main__':
+    main()
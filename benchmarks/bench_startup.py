@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+'''Measure what the plugin adds to the startup of a pytest run.
+
+    $ python benchmarks/bench_startup.py [repeat] [extra pytest args...]
+
+Reports the import time of pytest_concurrent and the wall time of a plain
+``pytest --collect-only`` over a small generated suite, with the plugin
+disabled (``-p no:concurrent``) and enabled, then the start latency of mproc
+workers with every start method (--concstart) as the session reports it.
+'''
+import os
+import multiprocessing
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def timed(cmd, cwd=None, repeat=10):
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        subprocess.check_call(cmd, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        timings.append(time.time() - start)
+    return sorted(timings)[len(timings) // 2]
+
+
+def make_suite(path, modules=20, tests=50):
+    for module in range(modules):
+        with open(os.path.join(path, 'test_startup_%d.py' % module), 'w') as test_file:
+            for test in range(tests):
+                test_file.write('def test_%d():\n    pass\n\n' % test)
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    python = sys.executable
+
+    baseline = timed([python, '-c', 'import pytest'], repeat=repeat)
+    plugin = timed([python, '-c', 'import pytest, pytest_concurrent'], repeat=repeat)
+    print('import pytest_concurrent      %8.1fms' % ((plugin - baseline) * 1000))
+
+    suite = tempfile.mkdtemp()
+    make_suite(suite)
+    collect = [python, '-m', 'pytest', '--collect-only', '-q', '-p', 'no:cacheprovider'] + sys.argv[2:]
+    without_plugin = timed(collect + ['-p', 'no:concurrent'], cwd=suite, repeat=repeat)
+    with_plugin = timed(collect, cwd=suite, repeat=repeat)
+    print('collect-only without plugin   %8.1fms' % (without_plugin * 1000))
+    print('collect-only with plugin      %8.1fms' % (with_plugin * 1000))
+
+    run = [python, '-m', 'pytest', '-p', 'no:cacheprovider', '--concmode=mproc', '--concworkers=4'] + sys.argv[2:]
+    for method in multiprocessing.get_all_start_methods():
+        output = subprocess.check_output(run + ['--concstart=%s' % method], cwd=suite).decode()
+        started = [line for line in output.splitlines() if ' workers started with ' in line]
+        print('%-10s %s' % (method, started[0] if started else 'no workers started'))
+
+
+if __name__ == '__main__':
+    main()
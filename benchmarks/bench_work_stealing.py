@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+'''Compare the makespan of --concsteal with the ThreadPoolExecutor dispatch of mthread mode.
+
+    $ python benchmarks/bench_work_stealing.py [workers]
+
+Synthetic items sleep for skewed durations and are spread over modules like
+a real suite. "executor" is what mthread mode does without --concsteal (batches
+in collection order, DISPATCH_FACTOR per worker in flight), "stealing" runs
+the same graph with per-worker deques, knowing the durations like it would
+from the cache. Both run with the items in collection order and in the order
+of --concorder=duration. The bound is the larger of the longest item and the total
+duration divided by the workers, no schedule can beat it.
+'''
+import sys
+import time
+import random
+import collections
+import concurrent.futures
+
+import pytest_concurrent
+
+ITEMS = 240
+MODULES = 12
+# mean item duration in seconds
+MEAN = 0.01
+
+
+class SyntheticModule(object):
+
+    def __init__(self, index):
+        self.nodeid = 'test_synthetic_%d.py' % index
+
+
+class SyntheticItem(object):
+
+    def __init__(self, index, module, duration):
+        self.nodeid = '%s::test_%d' % (module.nodeid, index)
+        self.module = module
+        self.duration = duration
+
+    def get_marker(self, name):
+        return None
+
+    def getparent(self, cls):
+        return self.module if cls is pytest_concurrent.pytest.Module else None
+
+
+def pareto(rng, count):
+    '''Heavy tailed durations in a random order'''
+    return [rng.paretovariate(1.5) for _ in range(count)]
+
+
+def long_tail_last(rng, count):
+    '''Mostly short items, with the few long ones collected last'''
+    durations = [rng.uniform(0.5, 1.5) for _ in range(count)]
+    return durations[:-count // 40] + [count / 8.0] * (count // 40)
+
+
+def lognormal(rng, count):
+    return [rng.lognormvariate(0, 1) for _ in range(count)]
+
+
+def make_items(distribution, seed=0):
+    rng = random.Random(seed)
+    durations = distribution(rng, ITEMS)
+    scale = MEAN * len(durations) / sum(durations)
+    modules = [SyntheticModule(index) for index in range(MODULES)]
+    return [SyntheticItem(index, modules[index * MODULES // len(durations)], duration * scale)
+            for index, duration in enumerate(durations)]
+
+
+def run_batch(batch, nextitem):
+    for item in batch:
+        time.sleep(item.duration)
+
+
+def make_graph(items, order):
+    if order == 'duration':
+        # what --concorder=duration does once the durations are in the cache
+        items = sorted(items, key=lambda item: -item.duration)
+    return pytest_concurrent.GroupGraph(collections.OrderedDict(ungrouped=[[item] for item in items]), {})
+
+
+def executor(items, workers, order):
+    graph = make_graph(items, order)
+    start = time.time()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        running = {}
+        while not graph.done:
+            for group, batch, nextitem in graph.dispatchable(pytest_concurrent.DISPATCH_FACTOR * workers - len(running)):
+                running[pool.submit(run_batch, batch, nextitem)] = batch
+            finished, _ = concurrent.futures.wait(list(running), return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                for item in running.pop(future):
+                    graph.finish(item)
+    return time.time() - start
+
+
+def stealing(items, workers, order):
+    durations = dict((item.nodeid, item.duration) for item in items)
+    graph = make_graph(items, order)
+    start = time.time()
+    pytest_concurrent._run_work_stealing(graph, workers, durations.get, run_batch, lambda: False)
+    return time.time() - start
+
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    for distribution in (pareto, long_tail_last, lognormal):
+        items = make_items(distribution)
+        durations = [item.duration for item in items]
+        bound = max(max(durations), sum(durations) / workers)
+        for order in ('collection', 'duration'):
+            for name, run in (('executor', executor), ('stealing', stealing)):
+                makespan = run(items, workers, order)
+                print('%-15s %-10s %-9s makespan %6.3fs bound %6.3fs (%.0f%% over)'
+                      % (distribution.__name__, order, name, makespan, bound, 100.0 * (makespan - bound) / bound))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,44 @@
 # -*- coding: utf-8 -*-
 import os
 import sys
+import json
+import inspect
 import time
+import select
+import signal
 import multiprocessing
+import multiprocessing.connection
 import concurrent.futures
 import collections
+import itertools
+import tempfile
+import threading
+import traceback
+import zlib
+
+try:
+    import queue
+except ImportError:  # python 2
+    import Queue as queue
+
+try:
+    from threading import get_ident
+except ImportError:  # python 2
+    from thread import get_ident
+
+try:
+    ConnectionRefusedError
+except NameError:  # python 2
+    import socket
+    ConnectionRefusedError = socket.error
 
-import psutil
 import py
 import pytest
+from _pytest.capture import CaptureManager
+from _pytest.runner import TestReport
+from _pytest.runner import call_and_report
+from _pytest.runner import runtestprotocol
+from _pytest.runner import show_test_item
 from _pytest.junitxml import LogXML
 from _pytest.terminal import TerminalReporter
 from _pytest.junitxml import Junit
@@ -16,32 +46,64 @@ from _pytest.junitxml import _NodeReporter
 from _pytest.junitxml import bin_xml_escape
 from _pytest.junitxml import mangle_test_address
 
-# Manager for the shared variables being used by in multiprocess mode
-MANAGER = multiprocessing.Manager()
+# a worker process flushes its buffered reports once either limit is reached
+REPORT_BATCH_SIZE = 64
+REPORT_FLUSH_INTERVAL = 0.2
 
-# to override the variable self.stats from LogXML
-XMLSTATS = MANAGER.dict()
-XMLSTATS['error'] = 0
-XMLSTATS['passed'] = 0
-XMLSTATS['failure'] = 0
-XMLSTATS['skipped'] = 0
+# batches handed out per worker at a time, the rest is dispatched as workers free up
+DISPATCH_FACTOR = 2
 
-# ensures that XMLSTATS is not being modified simultaneously
-XMLLOCK = multiprocessing.Lock()
+# how long a mproc worker waits for the next batch before tearing down all fixtures of the current one
+LOOKAHEAD_TIMEOUT = 0.1
 
-XMLREPORTER = MANAGER.dict()
-# XMLREPORTER_ORDERED = MANAGER.list()
-NODELOCK = multiprocessing.Lock()
-NODEREPORTS = MANAGER.list()
+MIB = 1024 * 1024
 
-# to keep track of the log for TerminalReporter
-DICTIONARY = MANAGER.dict()
+# room left in the start tag of a streamed JUnit XML testsuite for its final counts
+JUNIT_HEADER_ROOM = 128
 
-# to override the variable self.stats from TerminalReporter
-STATS = MANAGER.dict()
+# --concworkers=auto moves the amount of running items by one at most every AUTO_INTERVAL seconds,
+# keeping AUTO_MEMORY_RESERVE of the memory available and shrinking once the load is AUTO_OVERLOAD times the CPU count
+AUTO_INTERVAL = 1.0
+AUTO_MEMORY_RESERVE = 0.1
+AUTO_OVERLOAD = 1.5
 
-# ensures that STATS is not being modified simultaneously
-LOCK = multiprocessing.Lock()
+# threads of asyncio mode for synchronous tests and the setup and teardown of coroutine tests
+ASYNCIO_THREADS = 32
+
+# how long a remote worker keeps trying to connect to a session which is not listening yet,
+# and how long a remote mode session waits for a worker while it has none (concurrent_connect_timeout ini)
+WORKER_CONNECT_TIMEOUT = 30
+
+# how long a timed out mproc worker gets to exit after SIGTERM before it is killed with SIGKILL
+TERMINATE_TIMEOUT = 2
+
+# the output a mthread test phase writes is kept in memory up to CAPTURE_SPOOL_SIZE bytes, then in a temporary file,
+# outputs over it keep their first and last half of it in the report
+CAPTURE_SPOOL_SIZE = MIB
+
+# the failure score of a test is multiplied by FAILURE_DECAY every run and grows by one for every run it fails in,
+# scores below FAILURE_FORGET are dropped from the cache
+FAILURE_DECAY = 0.8
+FAILURE_FORGET = 0.01
+
+# TestReport attributes which are left out of a report record when they hold the default value
+REPORT_DEFAULTS = {'longrepr': None, 'sections': [], 'duration': 0, 'user_properties': []}
+
+
+class _Ungrouped(object):
+    '''Group key of the items without a concgroup marker, no concgroup name can be equal to it'''
+
+    def __repr__(self):
+        return 'ungrouped'
+
+    __str__ = __repr__
+
+    def __reduce__(self):
+        # stays the same object when a plan is pickled for a worker process
+        return 'UNGROUPED'
+
+
+UNGROUPED = _Ungrouped()
 
 
 def pytest_addoption(parser):
@@ -51,18 +113,163 @@ def pytest_addoption(parser):
         action='store',
         dest='concurrent_mode',
         default=None,
-        help='Set the concurrent mode (mthread, mproc, asyncnet)'
+        help='Set the concurrent mode (mthread, mproc, asyncnet, asyncio, hybrid, remote)'
     )
     group.addoption(
         '--concworkers',
         action='store',
         dest='concurrent_workers',
         default=None,
-        help='Set the concurrent worker amount (default to maximum)'
+        help='Set the concurrent worker amount (default to maximum), PROCESSESxTHREADS in hybrid mode, '
+             'auto or auto:MIN-MAX to adapt it to the available memory and CPU'
     )
 
-    parser.addini('concurrent_mode', 'Set the concurrent mode (mthread, mproc, asyncnet)')
+    group.addoption(
+        '--concserve',
+        action='store',
+        dest='concurrent_serve',
+        default=None,
+        metavar='HOST:PORT',
+        help='Set the address remote workers connect to in remote mode (default to 127.0.0.1 on a free port)'
+    )
+    group.addoption(
+        '--concworker-connect',
+        action='store',
+        dest='concurrent_worker_connect',
+        default=None,
+        metavar='HOST:PORT',
+        help='Run the tests a remote mode session at HOST:PORT hands out, instead of running a session'
+    )
+    group.addoption(
+        '--concstart',
+        action='store',
+        dest='concurrent_start',
+        default=None,
+        help='Set how mproc/hybrid worker processes are started (fork, forkserver, spawn, default to the platform default)'
+    )
+    group.addoption(
+        '--concforksession',
+        action='store_true',
+        dest='concurrent_fork_session',
+        default=False,
+        help='Set up session scoped fixtures once before forking mproc/hybrid workers, which share them copy-on-write'
+    )
+    group.addoption(
+        '--concterminate',
+        action='store_true',
+        dest='concurrent_terminate',
+        default=False,
+        help='Terminate running mproc/hybrid workers when the session stops early (-x, --maxfail)'
+    )
+    group.addoption(
+        '--conctimeout',
+        action='store',
+        dest='concurrent_timeout',
+        type=float,
+        default=None,
+        help='Report tests running longer than this amount of seconds as errors, mproc/hybrid workers running them are replaced'
+    )
+    group.addoption(
+        '--concmaxtests-per-worker',
+        action='store',
+        dest='concurrent_max_tests',
+        type=int,
+        default=None,
+        help='Replace a mproc/hybrid worker process with a fresh one after it ran this amount of tests'
+    )
+    group.addoption(
+        '--concmaxrss-per-worker',
+        action='store',
+        dest='concurrent_max_rss',
+        type=float,
+        default=None,
+        help='Replace a mproc/hybrid worker process with a fresh one once its RSS goes over this amount of MiB'
+    )
+    group.addoption(
+        '--conccompactstats',
+        action='store_true',
+        dest='concurrent_compact_stats',
+        default=False,
+        help='Only count passed reports in the terminal stats, full reports are kept where the summary needs them'
+    )
+    group.addoption(
+        '--conctrace',
+        action='store',
+        dest='concurrent_trace',
+        default=None,
+        metavar='path',
+        help='Write a Chrome trace (chrome://tracing, Perfetto) of every test phase per worker and group to path'
+    )
+    group.addoption(
+        '--concshard',
+        action='store',
+        dest='concurrent_shard',
+        default=None,
+        metavar='INDEX/TOTAL',
+        help='Only run shard INDEX (counting from 1) of TOTAL shards, of about the same duration with --concshardfile, '
+             'of about the same amount of tests otherwise'
+    )
+    group.addoption(
+        '--concshardplan',
+        action='store',
+        dest='concurrent_shard_plan',
+        type=int,
+        default=None,
+        metavar='TOTAL',
+        help='Print the tests and the duration of each of TOTAL shards instead of running the tests, '
+             'and write the plan to the --concshardfile path'
+    )
+    group.addoption(
+        '--concshardfile',
+        action='store',
+        dest='concurrent_shard_file',
+        default=None,
+        metavar='path',
+        help='Write the plan of --concshardplan to path, or read the shards of --concshard from it'
+    )
+    group.addoption(
+        '--concorder',
+        action='store',
+        dest='concurrent_order',
+        default=None,
+        help='Set the order items of a group are dispatched in (collection, duration, failures)'
+    )
+    group.addoption(
+        '--concbatch',
+        action='store_true',
+        dest='concurrent_batch',
+        default=False,
+        help='Run the items of a module which share module or class scoped fixtures on the same worker'
+    )
+    group.addoption(
+        '--concsteal',
+        action='store_true',
+        dest='concurrent_steal',
+        default=False,
+        help='Seed the batches of every worker by class or module and let idle workers steal from the busiest one (mthread, mproc, hybrid, remote)'
+    )
+    group.addoption(
+        '--concmakespan',
+        action='store_true',
+        dest='concurrent_makespan',
+        default=False,
+        help='Report the predicted and actual makespan of every group'
+    )
+
+    parser.addini('concurrent_mode', 'Set the concurrent mode (mthread, mproc, asyncnet, asyncio, hybrid, remote)')
+    parser.addini('concurrent_serve', 'Set the HOST:PORT remote workers connect to in remote mode')
+    parser.addini('concurrent_connect_timeout', 'Set the amount of seconds remote workers and sessions wait for each other (default to %d)'
+                  % WORKER_CONNECT_TIMEOUT)
     parser.addini('concurrent_workers', 'Set the concurrent worker amount (default to maximum)')
+    parser.addini('concurrent_start', 'Set how mproc/hybrid worker processes are started (fork, forkserver, spawn)')
+    parser.addini('concurrent_fork_session', 'Set up session scoped fixtures once before forking mproc/hybrid workers', type='bool', default=False)
+    parser.addini('concurrent_preload', 'Modules imported once into the forkserver (or the parent with fork) mproc/hybrid workers start from', type='linelist')
+    parser.addini('concurrent_timeout', 'Set the amount of seconds a test may run for (default to no limit)')
+    parser.addini('concurrent_order', 'Set the order items of a group are dispatched in (collection, duration, failures)')
+    parser.addini('concurrent_resources', 'Set the capacity of resources used with concresource ("name=amount" lines, default to 1)', type='linelist')
+    parser.addini('concurrent_compact_stats', 'Only count passed reports in the terminal stats', type='bool', default=False)
+    parser.addini('concurrent_batch', 'Run the items of a module which share module or class scoped fixtures on the same worker', type='bool', default=False)
+    parser.addini('concurrent_steal', 'Seed the batches of every worker by class or module and let idle workers steal from the busiest one', type='bool', default=False)
 
 
 def pytest_runtestloop(session):
@@ -73,32 +280,59 @@ def pytest_runtestloop(session):
         raise session.Interrupted(
             "%d errors during collection" % session.testsfailed)
 
-    if session.config.option.collectonly:
+    if session.config.option.collectonly or session.config.option.concurrent_shard_plan:
         return True
 
-    mode = session.config.option.concurrent_mode if session.config.option.concurrent_mode \
-        else session.config.getini('concurrent_mode')
-    if mode and mode not in ['mproc', 'mthread', 'asyncnet']:
-        raise NotImplementedError('Concurrent mode %s is not supported (available: mproc, mthread, asyncnet).' % mode)
-
-    try:
-        workers_raw = session.config.option.concurrent_workers if session.config.option.concurrent_workers else session.config.getini('concurrent_workers')
-
-        # set worker amount to the collected test amount
-        if workers_raw == 'max':
-            workers_raw = len(session.items)
+    if session.config.option.concurrent_worker_connect:
+        _run_remote_worker(session, session.config.option.concurrent_worker_connect)
+        return True
 
-        workers = int(workers_raw) if workers_raw else None
+    mode = _get_mode(session.config)
+    if mode and mode not in ['mproc', 'mthread', 'asyncnet', 'asyncio', 'hybrid', 'remote']:
+        raise NotImplementedError('Concurrent mode %s is not supported (available: mproc, mthread, asyncnet, asyncio, hybrid, remote).' % mode)
+
+    workers_raw = session.config.option.concurrent_workers if session.config.option.concurrent_workers else session.config.getini('concurrent_workers')
+    session.config._concurrent_auto = None
+    if str(workers_raw).startswith('auto'):
+        session.config._concurrent_auto = _parse_auto_workers(session.config, mode, workers_raw)
+    if _get_fork_session(session.config) and mode not in ['mproc', 'hybrid']:
+        raise ValueError('Forking after session fixtures is only supported in mproc and hybrid mode.')
+    if _get_steal(session.config):
+        if mode not in ['mthread', 'mproc', 'hybrid', 'remote']:
+            raise ValueError('Work stealing is only supported in mthread, mproc, hybrid and remote mode.')
+        if mode == 'mthread' and session.config._concurrent_auto:
+            raise ValueError('Work stealing in mthread mode needs a fixed amount of concurrent workers.')
+
+    # set worker amount to the collected test amount
+    if workers_raw == 'max':
+        workers_raw = len(session.items)
+
+    if session.config._concurrent_auto:
+        workers = session.config._concurrent_auto.maximum
+    elif mode == 'hybrid':
+        # raises its own ValueError, python 2 would not show it behind another one
+        workers = _parse_hybrid_workers(workers_raw)
+    else:
+        try:
+            workers = int(workers_raw) if workers_raw else None
+        except ValueError:
+            raise ValueError('Concurrent workers can only be integer.')
+
+    if sys.version_info < (3, 5) and sys.version_info > (3, 0) and mode != 'hybrid' and not session.config._concurrent_auto:
+        # backport max worker: https://github.com/python/cpython/blob/3.5/Lib/concurrent/futures/thread.py#L91-L94
+        if sys.version_info > (3, 4):
+            cpu_counter = os
+        else:
+            import psutil as cpu_counter
+        workers = (cpu_counter.cpu_count() or 1) * 5
 
-        if sys.version_info < (3, 5) and sys.version_info > (3, 0):
-            # backport max worker: https://github.com/python/cpython/blob/3.5/Lib/concurrent/futures/thread.py#L91-L94
-            cpu_counter = os if sys.version_info > (3, 4) else psutil
-            workers = (cpu_counter.cpu_count() or 1) * 5
-    except ValueError:
-        raise ValueError('Concurrent workers can only be integer.')
+    if _get_batch(session.config) and (mode in ['mthread', 'asyncio', 'asyncnet'] or mode == 'hybrid' and workers[1] > 1):
+        # the threads of a process share pytest's SetupState, which tears down what another thread still uses
+        raise ValueError('Fixture batching is only supported with one thread per process (mproc, remote or hybrid with 1 thread).')
 
     # group collected tests into different lists
-    groups = collections.defaultdict(list)
+    groups = collections.OrderedDict()
+    dependencies = collections.defaultdict(set)
     ungrouped_items = list()
     for item in session.items:
         concurrent_group_marker = item.get_marker('concgroup')
@@ -114,39 +348,365 @@ def pytest_runtestloop(session):
                 concurrent_group = concurrent_group_marker.kwargs['group']
 
         if concurrent_group:
-            if not isinstance(concurrent_group, int):
-                raise TypeError('Concurrent Group needs to be an integer')
-            groups[concurrent_group].append(item)
+            if not isinstance(concurrent_group, (int, str)):
+                raise TypeError('Concurrent Group needs to be an integer or a name')
+            groups.setdefault(concurrent_group, []).append(item)
+
+            after = concurrent_group_marker.kwargs.get('after', ())
+            if isinstance(after, (int, str)):
+                after = [after]
+            dependencies[concurrent_group].update(after)
         else:
             ungrouped_items.append(item)
 
-    for group in sorted(groups):
-        _run_items(mode=mode, items=groups[group], session=session, workers=workers)
+    # integer groups keep running one after another, ungrouped items run after all of them
+    numbered = sorted(group for group in groups if isinstance(group, int))
+    for previous, group in zip(numbered, numbered[1:]):
+        dependencies[group].add(previous)
     if ungrouped_items:
-        _run_items(mode=mode, items=ungrouped_items, session=session, workers=workers)
-
+        groups[UNGROUPED] = ungrouped_items
+        dependencies[UNGROUPED].update(numbered)
+
+    scheduler = session.config._concurrent_scheduler
+    plan = collections.OrderedDict()
+    for group in numbered + [group for group in groups if not isinstance(group, int)]:
+        plan[group] = scheduler.batch(scheduler.order(groups[group]))
+    graph = GroupGraph(plan, dependencies, _get_capacities(session.config))
+
+    _run_items(mode=mode, graph=graph, session=session, workers=workers)
+
+    tracer = session.config.pluginmanager.getplugin('concurrenttracer')
+    if tracer is not None:
+        tracer.add_groups(graph)
+
+    for group, batches in plan.items():
+        if group not in graph.finished:
+            # the session stopped before the group could finish
+            continue
+        items = [item for batch in batches for item in batch]
+        scheduler.add_makespan(group, scheduler.predict_makespan(items, _worker_count(mode, workers, len(items))),
+                               graph.finished[group] - graph.started[group])
+
+    _check_stop(session)
     return True
 
 
-def _run_items(mode, items, session, workers=None):
-    ''' Multiprocess is not compatible with Windows !!! '''
+class GroupGraph(object):
+    '''Tracks which concurrent groups can run, given the groups they have to run after.
+
+    A group starts once every group it depends on has finished all of its items,
+    groups without pending dependencies run at the same time. A batch of a started
+    group is only dispatched while the resources its items are marked with
+    (concresource) are below their capacity, other batches pass it meanwhile.
+    '''
+
+    def __init__(self, plan, dependencies, capacities=None):
+        self.plan = plan  # group -> batches
+        # dependencies on groups without collected items are ignored
+        self.dependencies = dict((group, set(dep for dep in dependencies.get(group, ()) if dep in plan))
+                                 for group in plan)
+        self.pending = dict((group, sum(len(batch) for batch in batches)) for group, batches in plan.items())
+        self.size = sum(self.pending.values())
+        self.waiting = list(plan)
+        self.started = {}
+        self.finished = {}
+        self._check_cycles()
+
+        self.capacities = capacities or {}
+        self.in_use = collections.Counter()
+        self.resource_names = set()
+        self.queued = []  # (group, iterator over (batch, nextitem)) of started groups
+        self.blocked = []  # (group, batch, nextitem, resources) waiting for their resources
+        self.running = {}  # id(item) -> (group, unfinished items of the batch, resources)
+
+    def _check_cycles(self):
+        visiting, done = set(), set()
+
+        def visit(group, path):
+            if group in done:
+                return
+            if group in visiting:
+                raise ValueError('Concurrent groups depend on each other: %s' % ' -> '.join(str(g) for g in path + [group]))
+            visiting.add(group)
+            for dependency in self.dependencies[group]:
+                visit(dependency, path + [group])
+            visiting.discard(group)
+            done.add(group)
+
+        for group in self.plan:
+            visit(group, [])
+
+    def capacity(self, resource):
+        return self.capacities.get(resource, 1)
+
+    def _start_ready_groups(self):
+        for group in list(self.waiting):
+            if self.dependencies[group].issubset(self.finished):
+                self.waiting.remove(group)
+                self.started[group] = time.time()
+                self.queued.append((group, _iter_batches(self.plan[group])))
+
+    def _acquire(self, resources):
+        if all(self.in_use[name] < self.capacity(name) for name in resources):
+            self.in_use.update(resources)
+            return True
+        return False
+
+    def _saturated(self):
+        return all(self.in_use[name] >= self.capacity(name) for name in self.resource_names)
+
+    def dispatchable(self, limit=None):
+        '''Start every waiting group whose dependencies have finished.
+
+        Returns the (group, batch, nextitem) of up to limit ready batches whose
+        resources are available, the resources are held until all items of the
+        batch are finished. Batches are pulled lazily from their group, so only
+        what is dispatched (or waits for a resource) is materialized.
+        '''
+        self._start_ready_groups()
+        runnable = []
+
+        blocked = []
+        for index, entry in enumerate(self.blocked):
+            if (limit is not None and len(runnable) >= limit) or self._saturated():
+                blocked.extend(self.blocked[index:])
+                break
+            if self._acquire(entry[3]):
+                runnable.append(entry)
+            else:
+                blocked.append(entry)
+        self.blocked = blocked
+
+        while self.queued and (limit is None or len(runnable) < limit):
+            group, batches = self.queued[0]
+            try:
+                batch, nextitem = next(batches)
+            except StopIteration:
+                self.queued.pop(0)
+                continue
+            resources = set(name for item in batch for name in _item_resources(item))
+            self.resource_names.update(resources)
+            if self._acquire(resources):
+                runnable.append((group, batch, nextitem, resources))
+            else:
+                self.blocked.append((group, batch, nextitem, resources))
+
+        for group, batch, _, resources in runnable:
+            entry = (group, set(id(item) for item in batch), resources)
+            for item in batch:
+                self.running[id(item)] = entry
+        return [(group, batch, nextitem) for group, batch, nextitem, _ in runnable]
+
+    def finish(self, item):
+        '''Mark an item as finished, returns whether its whole batch is finished'''
+        group, unfinished, resources = self.running.pop(id(item))
+        self.pending[group] -= 1
+        if not self.pending[group]:
+            self.finished[group] = time.time()
+        unfinished.discard(id(item))
+        if not unfinished:
+            self.in_use.subtract(resources)
+        return not unfinished
+
+    def has_dependents(self, group):
+        return any(group in dependencies for dependencies in self.dependencies.values())
+
+    @property
+    def done(self):
+        return len(self.finished) == len(self.plan)
+
+
+def _iter_batches(batches):
+    '''Yield every batch of a group with the item that follows it'''
+    for index, batch in enumerate(batches):
+        yield batch, batches[index + 1][0] if index + 1 < len(batches) else None
+
+
+class WorkStealing(object):
+    '''The per-worker deques of --concsteal.
+
+    Ready batches are seeded to the worker owning the class or module of their
+    first item. A class or module seen for the first time, or whose owner would
+    go over an even share of the estimated work queued, moves to the worker with
+    the least estimated work queued. A worker takes the head of its own deque,
+    once that is empty it steals the tail of the peer with the most estimated work
+    queued: the work a busy worker would have reached last starts right away.
+    '''
+
+    def __init__(self, estimate):
+        self.estimate = estimate
+        self.deques = collections.OrderedDict()  # worker -> deque of (group, batch, nextitem, estimate)
+        self.load = {}  # worker -> estimated seconds queued
+        self.owners = {}  # class or module nodeid -> worker
+        self.unowned = []  # batches seeded while there was no worker
+        self.taken = 0
+        self.stolen = 0
+
+    def add_worker(self, worker):
+        self.deques[worker] = collections.deque()
+        self.load[worker] = 0.0
+        unowned, self.unowned = self.unowned, []
+        self.seed(unowned)
+
+    def remove_worker(self, worker):
+        '''Forget a worker, the batches it did not take are seeded to the others'''
+        entries = self.deques.pop(worker)
+        del self.load[worker]
+        for key in [key for key, owner in self.owners.items() if owner == worker]:
+            del self.owners[key]
+        self.seed(entry[:3] for entry in entries)
+
+    def seed(self, entries):
+        entries = [(group, batch, nextitem, sum(self.estimate(item.nodeid) for item in batch))
+                   for group, batch, nextitem in entries]
+        if not self.deques:
+            self.unowned.extend(entry[:3] for entry in entries)
+            return
+        # an even share of everything queued once these entries are seeded
+        share = (sum(self.load.values()) + sum(entry[3] for entry in entries)) / len(self.deques)
+        for entry in entries:
+            key = _locality_key(entry[1][0])
+            owner = self.owners.get(key)
+            if owner not in self.load or (self.load[owner] and self.load[owner] + entry[3] > share):
+                owner = min(self.deques, key=lambda worker: (self.load[worker], len(self.deques[worker])))
+                self.owners[key] = owner
+            self.deques[owner].append(entry)
+            self.load[owner] += entry[3]
+
+    def take(self, worker):
+        '''The next (group, batch, nextitem) of a worker, None if no deque holds anything'''
+        owner = worker
+        if self.deques[worker]:
+            entry = self.deques[worker].popleft()
+        else:
+            owner = max(self.deques, key=lambda worker: (self.load[worker], len(self.deques[worker])))
+            if not self.deques[owner]:
+                return None
+            entry = self.deques[owner].pop()
+            self.stolen += 1
+        self.load[owner] = max(0.0, self.load[owner] - entry[3])
+        self.taken += 1
+        return entry[:3]
+
+
+def _locality_key(item):
+    '''Items with the same key are seeded to the same worker by --concsteal'''
+    parent = item.getparent(pytest.Class) or item.getparent(pytest.Module)
+    return parent.nodeid if parent is not None else item.nodeid
+
+
+def _item_tier(item):
+    '''Tier ("thread" or "process") an item runs in for hybrid mode'''
+    marker = item.get_marker('conctier')
+    tier = marker.args[0] if marker is not None and marker.args else 'thread'
+    if tier not in ['thread', 'process']:
+        raise ValueError('Concurrent tier %s is not supported (available: thread, process).' % tier)
+    return tier
+
+
+def _item_resources(item):
+    '''Names of the resources an item is marked with'''
+    marker = item.get_marker('concresource')
+    if marker is None:
+        return ()
+    return tuple(marker.args)
+
+
+def _item_timeout(item):
+    '''Seconds an item may run for (conctimeout marker, --conctimeout), None without limit'''
+    marker = item.get_marker('conctimeout')
+    if marker is not None and (marker.args or 'seconds' in marker.kwargs):
+        timeout = marker.kwargs.get('seconds', marker.args[0] if marker.args else None)
+    else:
+        timeout = item.config.option.concurrent_timeout or item.config.getini('concurrent_timeout')
+    return float(timeout) if timeout else None
+
+
+def _error_reports(item, message, duration=0):
+    '''Reports of an item which could not finish, logged like a setup error'''
+    keywords = dict((keyword, 1) for keyword in item.keywords)
+    return [TestReport(item.nodeid, item.location, keywords, 'failed', message, 'setup', duration=duration),
+            TestReport(item.nodeid, item.location, keywords, 'passed', None, 'teardown')]
+
+
+def _get_capacities(config):
+    '''Read the resource capacities ("name=amount" lines) of the concurrent_resources ini'''
+    capacities = {}
+    for line in config.getini('concurrent_resources'):
+        name, _, amount = line.partition('=')
+        try:
+            capacities[name.strip()] = int(amount) if amount.strip() else 1
+        except ValueError:
+            raise ValueError('Concurrent resource capacity can only be integer.')
+        if capacities[name.strip()] < 1:
+            raise ValueError('Concurrent resource capacity needs to be at least 1.')
+    return capacities
+
+
+def _run_items(mode, graph, session, workers=None):
+    ''' Multiprocess is not compatible with Windows !!!
+
+    Every batch runs on a single worker, the last item of a batch is followed
+    by the first item of the next batch of its group. All groups share the same
+    workers, a batch is dispatched as soon as the groups it runs after are done
+    and its resources are available. Only about DISPATCH_FACTOR batches per
+    worker are handed out at a time, the rest is pulled as workers free up.
+    '''
+    in_flight = DISPATCH_FACTOR * _worker_count(mode, workers, graph.size)
+    auto = session.config._concurrent_auto
+    # with --concworkers=auto only the admitted amount of batches is handed out, which is checked every AUTO_INTERVAL
+    wait_timeout = AUTO_INTERVAL if auto else None
+
     if mode == "mproc":
-        '''Using ThreadPoolExecutor as managers to control the lifecycle of processes.
-        Each thread will spawn a process and terminates when the process joins.
+        '''Using long-lived worker processes which get batches of item indexes over a pipe.
+        Each worker imports the test modules once and keeps fixtures alive between items.
+        '''
+        session.config._concurrent_pool.run(session, graph, workers)
+
+    elif mode == "hybrid":
+        '''Same as mproc, but every worker process pulls batches with several threads.
+        Batches with a process tier item (conctier('process')) run alone in their process.
+        '''
+        processes, threads = workers
+        session.config._concurrent_pool.run(session, graph, processes, threads)
+
+    elif mode == "remote":
+        '''Same as mproc, but the workers are pytest processes started with --concworker-connect,
+        possibly on other machines, which connect to the session over TCP.
         '''
-        def run_task_in_proc(item, index):
-            proc = multiprocessing.Process(target=_run_next_item, args=(session, item, index))
-            proc.start()
-            proc.join()
+        session.config._concurrent_pool.run(session, graph)
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
-            for index, item in enumerate(items):
-                executor.submit(run_task_in_proc, item, index)
+    elif mode == "mthread" and _get_steal(session.config):
+        def run(batch, nextitem):
+            try:
+                _run_batch(session, batch, nextitem)
+            except (session.Failed, session.Interrupted):
+                # the threads stop taking batches once the session has to stop
+                pass
+
+        stealing = _run_work_stealing(graph, _worker_count(mode, workers, graph.size),
+                                      session.config._concurrent_scheduler.estimate, run, lambda: _stop_reason(session))
+        session.config._concurrent_scheduler.add_stealing(stealing)
 
     elif mode == "mthread":
-        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
-            for index, item in enumerate(items):
-                executor.submit(_run_next_item, session, item, index)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=_worker_count(mode, workers, graph.size)) as executor:
+            running = {}
+            while not graph.done and not _stop_reason(session):
+                limit = auto.update(len(running)) if auto else in_flight
+                for group, batch, nextitem in graph.dispatchable(limit - len(running)):
+                    running[executor.submit(_run_batch, session, batch, nextitem)] = batch
+                finished, _ = concurrent.futures.wait(list(running), wait_timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    for item in running.pop(future):
+                        graph.finish(item)
+                    try:
+                        future.result()
+                    except (session.Failed, session.Interrupted):
+                        # the loop stops right below
+                        pass
+            # batches which did not start yet are dropped, the running ones stop after their current item
+            for future in running:
+                future.cancel()
 
     elif mode == "asyncnet":
         import gevent
@@ -154,39 +714,1974 @@ def _run_items(mode, items, session, workers=None):
         import gevent.pool
         gevent.monkey.patch_all()
         pool = gevent.pool.Pool(size=workers)
-        for index, item in enumerate(items):
-            pool.spawn(_run_next_item, session, item, index)
+        running = {}
+        while not graph.done and not _stop_reason(session):
+            for group, batch, nextitem in graph.dispatchable(in_flight - len(running)):
+                if _stop_reason(session):
+                    break
+                # blocks until the pool has a free slot
+                running[pool.spawn(_run_batch, session, batch, nextitem)] = batch
+            for greenlet in gevent.wait(list(running), count=1):
+                for item in running.pop(greenlet):
+                    graph.finish(item)
         pool.join()
 
+    elif mode == "asyncio":
+        '''Coroutine test functions are awaited on a single event loop, at most --concworkers
+        of them at a time, the synchronous part of the test protocol and synchronous tests
+        run off-loop in a pool of at most ASYNCIO_THREADS threads.
+        '''
+        import asyncio
+        loop = asyncio.new_event_loop()
+        session.config._concurrent_loop = loop
+        coroutines = _worker_count(mode, workers, graph.size)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(ASYNCIO_THREADS, coroutines)) as executor:
+                runner = CoroutineRunner(session, loop, executor, coroutines)
+                running = {}
+                while not graph.done and not _stop_reason(session):
+                    limit = auto.update(len(running)) if auto else in_flight
+                    for group, batch, nextitem in graph.dispatchable(limit - len(running)):
+                        running[runner.run_batch(batch, nextitem)] = batch
+                    finished, _ = loop.run_until_complete(asyncio.wait(list(running), timeout=wait_timeout,
+                                                                       return_when=asyncio.FIRST_COMPLETED))
+                    for future in finished:
+                        for item in running.pop(future):
+                            graph.finish(item)
+                if running:
+                    # the running batches stop after their current item
+                    loop.run_until_complete(asyncio.wait(list(running)))
+        finally:
+            session.config._concurrent_loop = None
+            loop.close()
+
+    else:
+        while not graph.done:
+            for group, batch, nextitem in graph.dispatchable(1):
+                _run_batch(session, batch, nextitem)
+                for item in batch:
+                    graph.finish(item)
+
+
+def _run_work_stealing(graph, workers, estimate, run, stopping):
+    '''Run the batches of a graph with the threads of --concsteal in mthread mode.
+
+    Every thread takes from its own deque or steals (see WorkStealing), run(batch, nextitem)
+    runs a batch and the threads stop taking batches once stopping() is true.
+    Returns the WorkStealing which was used.
+    '''
+    stealing = WorkStealing(estimate)
+    for worker in range(workers):
+        stealing.add_worker(worker)
+    condition = threading.Condition()
+    errors = []
+
+    def work(worker):
+        while True:
+            with condition:
+                entry = None
+                while entry is None:
+                    if graph.done or errors or stopping():
+                        return
+                    stealing.seed(graph.dispatchable())
+                    entry = stealing.take(worker)
+                    if entry is None:
+                        condition.wait()
+            group, batch, nextitem = entry
+            try:
+                run(batch, nextitem)
+            except BaseException as error:
+                errors.append(error)
+            finally:
+                with condition:
+                    for item in batch:
+                        graph.finish(item)
+                    condition.notify_all()
+
+    threads = [threading.Thread(target=work, args=(worker,)) for worker in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return stealing
+
+
+def _get_fork_session(config):
+    return config.option.concurrent_fork_session or config.getini('concurrent_fork_session')
+
+
+def _get_batch(config):
+    return config.option.concurrent_batch or config.getini('concurrent_batch')
+
+
+def _get_steal(config):
+    return config.option.concurrent_steal or config.getini('concurrent_steal')
+
+
+def _get_mode(config):
+    return config.option.concurrent_mode if config.option.concurrent_mode \
+        else config.getini('concurrent_mode')
+
+
+def _parse_hybrid_workers(workers_raw):
+    '''Parse the PROCESSESxTHREADS workers of hybrid mode (default to CPU count x 5)'''
+    if not workers_raw:
+        return None, 5
+    processes, _, threads = str(workers_raw).partition('x')
+    try:
+        return int(processes) if processes else None, int(threads) if threads else 1
+    except ValueError:
+        raise ValueError('Hybrid concurrent workers can only be PROCESSESxTHREADS integers (e.g. 8x16).')
+
+
+def _parse_auto_workers(config, mode, workers_raw):
+    '''Parse auto or auto:MIN-MAX workers (default to 1-4 times the CPU count)'''
+    if mode not in ['mthread', 'asyncio', 'mproc']:
+        raise ValueError('Automatic concurrent workers are only supported in mthread, asyncio and mproc mode.')
+    bounds = str(workers_raw)[len('auto'):]
+    try:
+        if bounds:
+            minimum, _, maximum = bounds.lstrip(':').partition('-')
+            return AutoWorkers(config, int(minimum), int(maximum))
+    except ValueError:
+        raise ValueError('Automatic concurrent workers can only be auto or auto:MIN-MAX integers (e.g. auto:2-16).')
+    return AutoWorkers(config)
+
+
+class AutoWorkers(object):
+    '''Admission control of --concworkers=auto.
+
+    The amount of items running at the same time grows by one while all of them
+    are busy and the machine has memory and CPU to spare, and shrinks by one once
+    less than AUTO_MEMORY_RESERVE of the memory is available or the 1 minute load
+    average goes over AUTO_OVERLOAD times the CPU count. The memory another item
+    needs is its peak RSS, the RSS growth of the process per running item in thread modes.
+    Every scaling decision is written to the terminal.
+    '''
+
+    def __init__(self, config, minimum=None, maximum=None):
+        import psutil
+        self.psutil = psutil
+        self.process = psutil.Process()
+        self.baseline = self.process.memory_info().rss
+        self.cpus = psutil.cpu_count() or 1
+        self.minimum = max(1, minimum or 1)
+        self.maximum = max(self.minimum, maximum or 4 * self.cpus)
+        self.limit = max(self.minimum, min(self.maximum, self.cpus))
+        self.last_update = time.time()
+        self.config = config
+
+    def update(self, running, item_rss=None):
+        '''The amount of items which may run now, running is the amount running at the moment'''
+        now = time.time()
+        if now - self.last_update < AUTO_INTERVAL:
+            return self.limit
+        self.last_update = now
+        if item_rss is None:
+            item_rss = max(0, self.process.memory_info().rss - self.baseline) / max(1, running)
+        memory = self.psutil.virtual_memory()
+        load = os.getloadavg()[0]
+        reserve = memory.total * AUTO_MEMORY_RESERVE
+        limit = self.limit
+        if memory.available < reserve or load > self.cpus * AUTO_OVERLOAD:
+            limit -= 1
+        elif running >= self.limit and memory.available - item_rss > reserve and load < self.cpus:
+            limit += 1
+        limit = max(self.minimum, min(self.maximum, limit))
+        if limit != self.limit:
+            reporter = self.config.pluginmanager.getplugin('terminalreporter')
+            if reporter is not None:
+                reporter.write_line('concurrent workers: %d -> %d (available memory %.0fMiB, load %.2f, item RSS %.1fMiB)'
+                                    % (self.limit, limit, memory.available / MIB, load, item_rss / MIB))
+            self.limit = limit
+        return self.limit
+
+
+def _worker_count(mode, workers, item_count):
+    '''Amount of items of a group which can run at the same time'''
+    if mode == 'hybrid':
+        processes, threads = workers
+        return max(1, min(_proc_worker_count(processes, item_count) * threads, item_count))
+    if mode == 'mproc':
+        return _proc_worker_count(workers, item_count)
+    if mode == 'mthread' and not workers:
+        # the default of ThreadPoolExecutor, which differs between python versions
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            workers = executor._max_workers
+    elif not mode:
+        workers = 1
+    return max(1, min(workers or item_count, item_count))
+
+
+def _proc_worker_count(workers, item_count):
+    '''Amount of worker processes to start for a list of items'''
+    if not workers:
+        import psutil
+        workers = psutil.cpu_count() or 1
+    return max(1, min(workers, item_count))
+
+
+class ProcWorkerPool(object):
+    '''Owns the worker processes of mproc mode and merges their report streams.
+
+    Nothing is created before the first group of items is run, and whatever is
+    still alive is torn down at the end of the session. Every worker gets its
+    batches over its own task pipe, so the pool knows which items a worker holds:
+    when one of them runs longer than its timeout or the worker dies, the worker
+    is replaced and the batches it did not start are handed out again.
+    '''
+
+    def __init__(self, terminate=False):
+        self.terminate = terminate
+        self.stopped = None
+        self.workers = []
+        self.history = []  # (name, tests, peak rss, why it stopped) of every worker which stopped
+        self.start_latencies = []  # seconds from starting a worker process until it could run items
+        self.start_method = None
+        self.shared_fixtures = []  # FixtureDefs set up before forking with --concforksession
+        self.shared_setup = 0
+        self.memory = []  # (private, shared) bytes of the RSS of every worker before it exited
+        self.stealing = None
+
+    def run(self, session, graph, workers=None, threads=1):
+        self.session = session
+        self.graph = graph
+        self.threads = threads
+        self.items = [item for batches in graph.plan.values() for batch in batches for item in batch]
+        self.positions = dict((id(item), index) for index, item in enumerate(self.items))
+        self.timeouts = [_item_timeout(item) for item in self.items]
+        self.shortest_timeout = min([timeout for timeout in self.timeouts if timeout] or [None])
+        self.stopped = multiprocessing.RawValue('b', 0)
+        self.requeued = collections.deque()
+        self.start_method = _prepare_start_method(session.config)
+        if _get_fork_session(session.config):
+            if self.start_method != 'fork':
+                raise ValueError('Forking after session fixtures needs the fork start method (not %s).' % self.start_method)
+            started = time.time()
+            session.config._concurrent_shared_fixtures = self.shared_fixtures = _setup_session_fixtures(self.items)
+            self.shared_setup = time.time() - started
+        scheduler = session.config._concurrent_scheduler
+        self.stealing = WorkStealing(scheduler.estimate) if _get_steal(session.config) else None
+
+        self.auto = session.config._concurrent_auto
+
+        self.start_workers(self.auto.limit if self.auto else _proc_worker_count(workers, len(self.items)))
+        self.dispatch()
+
+        while self.serving():
+            readers = dict((worker.reader, worker) for worker in self.workers)
+            for ready in _wait(list(readers) + self.waitables(), self.poll_timeout()):
+                if ready in readers:
+                    self.receive(readers[ready])
+                else:
+                    self.join_workers()
+            self.kill_overdue()
+            self.scale()
+        if self.stealing is not None:
+            scheduler.add_stealing(self.stealing)
+        self.close()
+
+    def start_workers(self, count):
+        for _ in range(count):
+            self.start_worker()
+
+    def start_worker(self):
+        self.add_worker(ProcWorker(self.session, self.items, self.stopped, self.threads, self.start_method))
+
+    def add_worker(self, worker):
+        self.workers.append(worker)
+        if self.stealing is not None:
+            self.stealing.add_worker(worker)
+
+    def remove_worker(self, worker):
+        self.workers.remove(worker)
+        if self.stealing is not None:
+            self.stealing.remove_worker(worker)
+
+    def serving(self):
+        return bool(self.workers)
+
+    def waitables(self):
+        '''What else the pool waits for besides the reports of its workers'''
+        return []
+
+    def join_workers(self):
+        pass
+
+    def dispatch(self):
+        '''Hand out batches until every worker holds DISPATCH_FACTOR per thread'''
+        def spare(worker):
+            return DISPATCH_FACTOR * self.threads - len(worker.batches)
+
+        # workers which are shut down (--concworkers=auto) get nothing after their sentinel
+        workers = [worker for worker in self.workers if not worker.closing]
+        if not workers or self.stopped.value:
+            return
+        while self.requeued and spare(max(workers, key=spare)) > 0:
+            max(workers, key=spare).assign(*self.requeued.popleft())
+        if self.stealing is not None:
+            # every worker fills up from its own deque, or steals once that is empty
+            self.stealing.seed(self.graph.dispatchable())
+            for worker in workers:
+                while spare(worker) > 0:
+                    entry = self.stealing.take(worker)
+                    if entry is None:
+                        break
+                    self.assign(worker, entry[0], entry[1])
+        else:
+            for group, batch, _ in self.graph.dispatchable(sum(max(0, spare(worker)) for worker in workers)):
+                self.assign(max(workers, key=spare), group, batch)
+        if self.graph.done:
+            self.shutdown()
+
+    def assign(self, worker, group, batch):
+        exclusive = any(_item_tier(item) == 'process' for item in batch)
+        worker.assign([self.positions[id(item)] for item in batch], self.graph.has_dependents(group), exclusive)
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.shutdown()
+
+    def receive(self, worker):
+        try:
+            batch, fixture_setups = worker.reader.recv()
+        except EOFError:
+            self.lost(worker)
+            return
+        if fixture_setups:
+            self.session.config._concurrent_scheduler.add_fixture_setups(fixture_setups)
+        for index, records in batch:
+            self.item_done(worker, index, [_record_to_report(record) for record in records])
+
+    def item_done(self, worker, index, reports):
+        _log_item_reports(self.items[index], reports)
+        worker.done(index)
+        self.graph.finish(self.items[index])
+        if not _stop_reason(self.session):
+            self.dispatch()
+        elif not self.stopped.value:
+            # workers stop before their next item, batches they did not start are skipped
+            self.stopped.value = 1
+            self.shutdown()
+            if self.terminate:
+                for worker in self.workers:
+                    worker.terminate()
+
+    def scale(self):
+        '''Start or shut down workers to follow the admission control of --concworkers=auto'''
+        if self.auto is None or self.stopped.value or self.graph.done:
+            return
+        active = [worker for worker in self.workers if not worker.closing]
+        busy = len([worker for worker in active if worker.batches])
+        limit = self.auto.update(busy, max(worker.usage[1] for worker in active) if active else None)
+        for _ in range(limit - len(active)):
+            self.start_worker()
+        for worker in sorted(active, key=lambda worker: len(worker.batches))[:max(0, len(active) - limit)]:
+            worker.shutdown()
+        self.dispatch()
+
+    def poll_timeout(self):
+        '''How long to wait for reports before looking for timed out items (or scaling) again'''
+        waits = [AUTO_INTERVAL] if self.auto is not None else []
+        if self.shortest_timeout is not None:
+            deadlines = [started + self.timeouts[index] - time.time()
+                         for worker in self.workers for index, started in worker.running() if self.timeouts[index]]
+            # an item which starts in the meantime cannot time out before the shortest timeout
+            waits.append(max(0, min(deadlines + [self.shortest_timeout])))
+        return min(waits) if waits else None
+
+    def kill_overdue(self):
+        now = time.time()
+        for worker in list(self.workers):
+            for index, started in worker.running():
+                if self.timeouts[index] and now - started > self.timeouts[index]:
+                    worker.kill()
+                    self.replace(worker, index, 'Timeout: the test ran longer than %ss, its worker was terminated'
+                                 % self.timeouts[index])
+                    break
+
+    def lost(self, worker):
+        '''A worker closed its report pipe, it has to be replaced unless it was shut down'''
+        if worker.closing or self.stopped.value:
+            self.remove_worker(worker)
+            self.retire(worker, 'recycled' if worker.usage[2] else 'done')
+        elif not worker.usage[3]:
+            # a worker which fails to collect the session again would be replaced forever
+            raise self.session.Interrupted('A concurrent worker %s before it could run tests' % worker.lost_reason())
+        else:
+            self.replace(worker, None, None)
+
+    def replace(self, worker, index, message):
+        '''Start a new worker for a killed or crashed one, the items which were running
+        in it are reported as errors and the batches it did not start are handed out again'''
+        self.remove_worker(worker)
+        # reports which were sent before the worker went away are still in the pipe
+        while True:
+            try:
+                batch, _ = worker.reader.recv()
+            except (EOFError, OSError):
+                break
+            for done, records in batch:
+                self.item_done(worker, done, [_record_to_report(record) for record in records])
+        running = dict(worker.running())
+        if message is not None:
+            self.retire(worker, 'timed out')
+        elif worker.usage[2]:
+            self.retire(worker, 'recycled')
+        else:
+            self.retire(worker, 'crashed')
+        if not self.stopped.value:
+            self.start_worker()
+        for first, (indexes, urgent, exclusive) in worker.batches.items():
+            # items of the batch which were reported already are not run again
+            remaining = [other for other in indexes if other in worker.batch_of and other not in running]
+            if remaining:
+                self.requeued.append((remaining, urgent, exclusive))
+                for other in remaining:
+                    worker.batch_of.pop(other)
+        for other, started in running.items():
+            if other == index:
+                error = message
+            elif message is not None:
+                error = 'The worker running the test was terminated because %s timed out' % self.items[index].nodeid
+            else:
+                error = 'The worker running the test %s' % worker.lost_reason()
+            self.item_done(worker, other, _error_reports(self.items[other], error, time.time() - started))
+        self.dispatch()
+
+    def retire(self, worker, reason):
+        worker.close()
+        self.history.append((worker.name, int(worker.usage[0]), worker.usage[1], reason))
+        if worker.launched is not None and worker.usage[3]:
+            self.start_latencies.append(worker.usage[3] - worker.launched)
+        if worker.usage[4]:
+            self.memory.append((worker.usage[4], worker.usage[5]))
+
+    def close(self):
+        for worker in self.workers:
+            self.retire(worker, 'done')
+        self.stopped = None
+        self.workers = []
+
+    def pytest_sessionfinish(self):
+        self.close()
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if not self.history:
+            return
+        terminalreporter.write_sep('-', 'concurrent workers')
+        for name, tests, peak, reason in sorted(self.history):
+            rss = ', peak RSS %.1fMiB' % (peak / MIB) if peak is not None else ''
+            terminalreporter.write_line('worker %s: %d tests%s (%s)' % (name, tests, rss, reason))
+        if self.start_latencies:
+            terminalreporter.write_line('%d workers started with %s in %.3fs on average, %.3fs at most' % (
+                len(self.start_latencies), self.start_method,
+                sum(self.start_latencies) / len(self.start_latencies), max(self.start_latencies)))
+        if self.shared_fixtures:
+            terminalreporter.write_line('session fixtures set up before forking in %.2fs: %s' % (
+                self.shared_setup, ', '.join(fixturedef.argname for fixturedef in self.shared_fixtures)))
+        if self.memory:
+            terminalreporter.write_line('RSS per worker on average: %.1fMiB shared, %.1fMiB private' % (
+                sum(shared for _, shared in self.memory) / len(self.memory) / MIB,
+                sum(private for private, _ in self.memory) / len(self.memory) / MIB))
+
+
+class ProcWorker(object):
+    '''A worker process of mproc mode as seen from the parent process.
+
+    Each thread of the worker publishes the index of its current item (-1 while
+    idle) and when it started in shared memory, which is how timed out items are found.
+    The worker also publishes the amount of items it ran, its peak RSS, whether
+    it retired because it went over --concmaxtests-per-worker or --concmaxrss-per-worker,
+    when it was ready to run items and the private and shared part of its RSS
+    when it peaked.
+
+    The session cannot be pickled, so a worker started with forkserver or spawn
+    runs pytest with the arguments of the session and collects the items again.
+    '''
+
+    def __init__(self, session, items, stopped, threads, start_method=None):
+        context = _get_context(start_method)
+        task_reader, self.tasks = context.Pipe(duplex=False)
+        self.reader, writer = context.Pipe(duplex=False)
+        self.current = context.RawArray('d', [-1, 0] * threads)
+        self.usage = context.RawArray('d', 6)
+        self.threads = threads
+        self.batches = collections.OrderedDict()  # first item index -> (indexes, urgent, exclusive)
+        self.batch_of = {}  # item index -> first item index of its batch, until it is reported
+        self.closing = False
+        state = WorkerState(stopped, self.current, self.usage)
+        if getattr(context, 'get_start_method', lambda: 'fork')() == 'fork':
+            self.proc = context.Process(target=_run_worker_proc, args=(session, items, task_reader, writer, state, threads))
+        else:
+            self.proc = context.Process(target=_run_spawned_worker, args=(
+                str(session.config.invocation_dir), list(session.config._origargs), [item.nodeid for item in items],
+                task_reader, writer, state, threads))
+        self.launched = time.time()
+        self.proc.start()
+        self.name = str(self.proc.pid)
+        # only the worker keeps these ends, so the reader sees EOF when it exits
+        task_reader.close()
+        writer.close()
+
+    def assign(self, indexes, urgent, exclusive):
+        self.batches[indexes[0]] = (indexes, urgent, exclusive)
+        for index in indexes:
+            self.batch_of[index] = indexes[0]
+        try:
+            self.tasks.send((indexes, urgent, exclusive))
+        except OSError:
+            # the worker is gone, its batches are handed out again once its reader sees EOF
+            pass
+
+    def done(self, index):
+        first = self.batch_of.pop(index, None)
+        if first is not None and not any(self.batch_of.get(other) == first for other in self.batches[first][0]):
+            del self.batches[first]
+
+    def running(self):
+        '''(index, start time) of the items the worker threads are running'''
+        current = self.current[:]
+        return [(int(current[slot]), current[slot + 1]) for slot in range(0, len(current), 2)
+                if int(current[slot]) in self.batch_of]
+
+    def shutdown(self):
+        # one sentinel for each thread, they exit once they ran what they hold
+        if not self.closing:
+            self.closing = True
+            try:
+                for _ in range(self.threads):
+                    self.tasks.send(None)
+            except OSError:
+                pass
+
+    def lost_reason(self):
+        # the report pipe closes right before the process exits
+        self.proc.join(TERMINATE_TIMEOUT)
+        return 'exited unexpectedly (exit code %s)' % self.proc.exitcode
+
+    def terminate(self):
+        self.proc.terminate()
+
+    def kill(self):
+        '''Terminate the worker, escalating to SIGKILL if it does not exit in time'''
+        self.proc.terminate()
+        self.proc.join(TERMINATE_TIMEOUT)
+        if self.proc.is_alive():
+            os.kill(self.proc.pid, signal.SIGKILL)
+            self.proc.join()
+
+    def close(self):
+        if self.proc.is_alive():
+            self.proc.terminate()
+        self.proc.join()
+        self.tasks.close()
+        self.reader.close()
+
+
+class RemoteWorkerPool(ProcWorkerPool):
+    '''Serves the batches of remote mode to pytest processes started with
+    --concworker-connect, on this or other machines, instead of forking workers.
+
+    Workers may connect at any time during the session. Connections are
+    authenticated with multiprocessing's HMAC challenge before anything is
+    unpickled (see _make_authkey), and a worker has to have collected every item
+    of the session. Workers which go away are not replaced, the batches they did
+    not finish are handed to the others; the session stops once it had no worker
+    for the connect timeout.
+    '''
+
+    def __init__(self, config, address, terminate=False):
+        ProcWorkerPool.__init__(self, terminate)
+        host, port = _parse_address(address)
+        authkey, self.authkey_file = _make_authkey(config, host)
+        self.listener = multiprocessing.connection.Listener((host, port), authkey=authkey)
+        self.address = '%s:%d' % self.listener.address
+        if self.authkey_file is not None:
+            self.authkey_file = _write_authkey(self.authkey_file, self.listener.address[1], authkey)
+        self.connect_timeout = _get_connect_timeout(config)
+        self.idle_since = None
+        self.lock = threading.Lock()
+        self.joined = []  # (connection, name) of workers which connected since the last wake up
+        self.wakeup, self.notify = multiprocessing.Pipe(duplex=False)
+        self.accepting = None
+
+    def start_workers(self, count):
+        if self.accepting is None:
+            self.accepting = threading.Thread(target=self.accept, args=([item.nodeid for item in self.items],))
+            self.accepting.daemon = True
+            self.accepting.start()
+
+    def start_worker(self):
+        pass
+
+    def accept(self, nodeids):
+        while True:
+            try:
+                connection = self.listener.accept()
+            except multiprocessing.AuthenticationError:
+                continue
+            except OSError:
+                # the listener is closed at the end of the session
+                return
+            try:
+                connection.send(nodeids)
+                missing = connection.recv()
+            except (EOFError, OSError):
+                continue
+            if missing:
+                connection.close()
+                continue
+            with self.lock:
+                self.joined.append((connection, '%s:%d' % self.listener.last_accepted))
+            self.notify.send_bytes(b'')
+
+    def serving(self):
+        if self.workers or self.graph.done or self.stopped.value:
+            self.idle_since = None
+            return bool(self.workers)
+        # without workers the session waits for more to connect
+        if self.idle_since is None:
+            self.idle_since = time.time()
+        elif time.time() - self.idle_since >= self.connect_timeout:
+            raise self.session.Interrupted('No concurrent worker connected to %s within %ss'
+                                           % (self.address, self.connect_timeout))
+        return True
+
+    def poll_timeout(self):
+        timeout = ProcWorkerPool.poll_timeout(self)
+        if self.idle_since is None:
+            return timeout
+        remaining = max(0, self.idle_since + self.connect_timeout - time.time())
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def waitables(self):
+        return [self.wakeup]
+
+    def join_workers(self):
+        while self.wakeup.poll():
+            self.wakeup.recv_bytes()
+        with self.lock:
+            joined, self.joined = self.joined, []
+        for connection, name in joined:
+            self.add_worker(RemoteWorker(connection, name))
+        self.dispatch()
+
+    def pytest_report_header(self):
+        return 'concurrent workers connect to: %s' % self.address
+
+    def pytest_sessionfinish(self):
+        self.close()
+        self.listener.close()
+        if self.authkey_file is not None and self.authkey_file.check():
+            self.authkey_file.remove()
+        with self.lock:
+            for connection, _ in self.joined:
+                connection.close()
+
+
+class RemoteWorker(ProcWorker):
+    '''A worker connected to a RemoteWorkerPool, tasks and reports share its connection.
+
+    Remote workers run one item at a time and in the order of their batches,
+    so the first unreported item is the one running since the previous one was
+    reported (or since its batch was sent to an idle worker).
+    '''
+
+    def __init__(self, connection, name):
+        self.tasks = self.reader = connection
+        self.name = name
+        self.started = time.time()
+        # the RSS of remote workers is not known, they are ready once connected
+        self.usage = [0, None, 0, self.started, 0, 0]
+        self.launched = None
+        self.threads = 1
+        self.batches = collections.OrderedDict()
+        self.batch_of = collections.OrderedDict()
+        self.closing = False
+
+    def assign(self, indexes, urgent, exclusive):
+        if not self.batch_of:
+            self.started = time.time()
+        ProcWorker.assign(self, indexes, urgent, exclusive)
+
+    def done(self, index):
+        ProcWorker.done(self, index)
+        self.usage[0] += 1
+        self.started = time.time()
+
+    def running(self):
+        return [(next(iter(self.batch_of)), self.started)] if self.batch_of else []
+
+    def lost_reason(self):
+        return 'closed its connection unexpectedly'
+
+    def terminate(self):
+        self.tasks.close()
+
+    def kill(self):
+        self.tasks.close()
+
+    def close(self):
+        self.tasks.close()
+
+
+def _parse_address(address):
+    '''Parse a HOST:PORT address'''
+    host, _, port = address.rpartition(':')
+    try:
+        return host or '127.0.0.1', int(port)
+    except ValueError:
+        raise ValueError('Concurrent address can only be HOST:PORT (e.g. 127.0.0.1:8765).')
+
+
+def _get_connect_timeout(config):
+    timeout = config.getini('concurrent_connect_timeout')
+    return float(timeout) if timeout else WORKER_CONNECT_TIMEOUT
+
+
+def _authkey_dir(config, host):
+    '''Where a session on the loopback interface leaves its key for the workers of the same rootdir'''
+    if host not in ['localhost', '127.0.0.1', '::1']:
+        raise ValueError('Set the PYTEST_CONCURRENT_AUTHKEY environment variable to use remote workers on %s.' % host)
+    cache = getattr(config, 'cache', None)
+    if cache is None:
+        raise ValueError('Set the PYTEST_CONCURRENT_AUTHKEY environment variable to use remote workers without the cacheprovider plugin.')
+    return cache.makedir('concurrent')
+
+
+def _make_authkey(config, host):
+    '''Key which authenticates the connections of remote mode and the directory it has to be written to.
+
+    PYTEST_CONCURRENT_AUTHKEY is required on other interfaces than the loopback one,
+    there the session makes up a random key which only the current user can read.
+    '''
+    authkey = os.environ.get('PYTEST_CONCURRENT_AUTHKEY')
+    if authkey:
+        return authkey.encode('utf-8'), None
+    return os.urandom(32), _authkey_dir(config, host)
+
+
+def _write_authkey(directory, port, authkey):
+    path = directory.join('authkey-%d' % port)
+    if path.check():
+        path.remove()
+    descriptor = os.open(str(path), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(descriptor, 'wb') as key_file:
+        key_file.write(authkey)
+    return path
+
+
+def _read_authkey(config, host, port):
+    '''Key of a session for a worker, None while a session on the loopback interface did not write it yet'''
+    authkey = os.environ.get('PYTEST_CONCURRENT_AUTHKEY')
+    if authkey:
+        return authkey.encode('utf-8')
+    path = _authkey_dir(config, host).join('authkey-%d' % port)
+    try:
+        return path.read_binary()
+    except py.error.ENOENT:
+        return None
+
+
+def _run_remote_worker(session, address):
+    '''Main function of pytest --concworker-connect: run the batches a remote mode session sends'''
+    host, port = _parse_address(address)
+    deadline = time.time() + _get_connect_timeout(session.config)
+    while True:
+        authkey = _read_authkey(session.config, host, port)
+        if authkey is not None:
+            try:
+                connection = multiprocessing.connection.Client((host, port), authkey=authkey)
+                break
+            except (ConnectionRefusedError, multiprocessing.AuthenticationError):
+                # the session may still be collecting, or the key was left behind by a session which is gone
+                if time.time() > deadline:
+                    raise
+        elif time.time() > deadline:
+            raise session.Interrupted('No concurrent session at %s wrote its key within %ss'
+                                      % (address, _get_connect_timeout(session.config)))
+        time.sleep(0.1)
+    nodeids = connection.recv()
+    collected = dict((item.nodeid, item) for item in session.items)
+    missing = [nodeid for nodeid in nodeids if nodeid not in collected]
+    connection.send(missing)
+    if missing:
+        connection.close()
+        raise session.Interrupted('%d tests of the session were not collected by this worker, e.g. %s'
+                                  % (len(missing), missing[0]))
+    state = WorkerState(multiprocessing.RawValue('b', 0), multiprocessing.RawArray('d', [-1, 0]),
+                        multiprocessing.RawArray('d', 6))
+    _run_worker_proc(session, [collected[nodeid] for nodeid in nodeids], connection, connection, state)
+
+
+def _shareable(name2fixturedefs, name):
+    '''Whether a fixture is session scoped and neither it nor what it depends on is parametrized'''
+    fixturedefs = name2fixturedefs.get(name)
+    if not fixturedefs:
+        return False
+    fixturedef = fixturedefs[-1]
+    return fixturedef.scope == 'session' and fixturedef.params is None and all(
+        argname == 'request' or _shareable(name2fixturedefs, argname) for argname in fixturedef.argnames)
+
+
+def _setup_session_fixtures(items):
+    '''Set up the session scoped fixtures of items in the session process for --concforksession.
+
+    Returns their FixtureDefs, which the session tears down at its end. Threads do not
+    survive a fork and a socket would be shared by every worker, so a fixture which
+    leaves any of them behind fails the session.
+    '''
+    import psutil
+    from _pytest.fixtures import FixtureRequest
+    process = psutil.Process()
+    connections = getattr(process, 'net_connections', process.connections)
+    shared = collections.OrderedDict()  # id(FixtureDef) -> FixtureDef
+    for item in items:
+        fixtureinfo = getattr(item, '_fixtureinfo', None)
+        if fixtureinfo is None:
+            continue
+        for name in fixtureinfo.names_closure:
+            if not _shareable(fixtureinfo.name2fixturedefs, name) or id(fixtureinfo.name2fixturedefs[name][-1]) in shared:
+                continue
+            threads = set(threading.enumerate())
+            sockets = set(connection.fd for connection in connections('all'))
+            FixtureRequest(item).getfixturevalue(name)
+            started = [thread.name for thread in threading.enumerate() if thread not in threads]
+            opened = [str(connection.fd) for connection in connections('all') if connection.fd not in sockets]
+            left = []
+            if started:
+                left.append('threads %s' % ', '.join(started))
+            if opened:
+                left.append('sockets (fd %s)' % ', '.join(opened))
+            if left:
+                raise RuntimeError('Session fixture %s cannot be shared with forked workers, it left %s behind '
+                                   '(run without --concforksession or create them in the workers)' % (name, ' and '.join(left)))
+            shared[id(fixtureinfo.name2fixturedefs[name][-1])] = fixtureinfo.name2fixturedefs[name][-1]
+    return list(shared.values())
+
+
+def _keep_shared_fixtures(session, fixturedefs):
+    '''Keep the session fixtures a forked worker inherited, the session process tears them down'''
+    for fixturedef in fixturedefs:
+        fixturedef._finalizers = []
+        # tearing them down would set them up again in this worker
+        fixturedef.finish = lambda request: None
+    if fixturedefs:
+        session._setupstate._finalizers.pop(session, None)
+
+
+def _prepare_start_method(config):
+    '''The start method of mproc/hybrid workers, with the concurrent_preload modules loaded where workers start from'''
+    # python 2 only forks
+    methods = multiprocessing.get_all_start_methods() if hasattr(multiprocessing, 'get_all_start_methods') else ['fork']
+    method = config.option.concurrent_start or config.getini('concurrent_start') or \
+        (multiprocessing.get_start_method() if hasattr(multiprocessing, 'get_start_method') else 'fork')
+    if method not in methods:
+        raise NotImplementedError('Concurrent start method %s is not supported (available: %s).'
+                                  % (method, ', '.join(methods)))
+    preload = config.getini('concurrent_preload')
+    if method == 'forkserver':
+        # only used when the forkserver starts, which is the first forkserver worker of the process
+        _get_context(method).set_forkserver_preload(['pytest_concurrent'] + preload)
+    elif method == 'fork':
+        for module in preload:
+            __import__(module)
+    return method
+
+
+def _get_context(method):
+    '''multiprocessing context of a start method, python 2 has the fork one only'''
+    return multiprocessing.get_context(method) if hasattr(multiprocessing, 'get_context') else multiprocessing
+
+
+def _wait(connections, timeout=None):
+    '''multiprocessing.connection.wait, which python 2 does not have'''
+    if hasattr(multiprocessing.connection, 'wait'):
+        return multiprocessing.connection.wait(connections, timeout)
+    return select.select(connections, [], [], timeout)[0]
+
+
+class SpawnedWorker(object):
+    '''Runs the items a mproc session hands out in a worker started with forkserver or spawn,
+    once the session the worker collected again has all of them'''
+
+    def __init__(self, nodeids, task_reader, writer, state, threads):
+        self.nodeids = nodeids
+        self.task_reader = task_reader
+        self.writer = writer
+        self.state = state
+        self.threads = threads
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtestloop(self, session):
+        collected = dict((item.nodeid, item) for item in session.items)
+        missing = [nodeid for nodeid in self.nodeids if nodeid not in collected]
+        if missing:
+            raise session.Interrupted('%d tests of the session were not collected by this worker, e.g. %s'
+                                      % (len(missing), missing[0]))
+        _run_worker_proc(session, [collected[nodeid] for nodeid in self.nodeids],
+                         self.task_reader, self.writer, self.state, self.threads)
+        return True
+
+
+def _run_spawned_worker(invocation_dir, args, nodeids, task_reader, writer, state, threads):
+    '''Main function of a mproc (or hybrid) worker process started with forkserver or spawn'''
+    os.chdir(invocation_dir)
+    # the session prints the results, the worker only its own errors
+    pytest.main(args + ['-p', 'no:terminal'], plugins=[SpawnedWorker(nodeids, task_reader, writer, state, threads)])
+
+
+def _run_worker_proc(session, items, task_reader, writer, state, threads=1):
+    '''Main function of a mproc (or hybrid) worker process.
+
+    Reports are not logged in the worker, they are buffered and sent to the
+    parent process in batches instead. In hybrid mode the tasks are pulled by
+    several threads of the process.
+    '''
+    scheduler = session.config._concurrent_scheduler
+    stream = ReportStream(writer, lambda: scheduler.fixture_setups)
+    state.set_limits(session.config)
+    _keep_shared_fixtures(session, getattr(session.config, '_concurrent_shared_fixtures', []))
+    state.usage[3] = time.time()
+    task_queue = queue.Queue()
+    feeder = threading.Thread(target=_feed_worker_tasks, args=(task_reader, task_queue, threads))
+    feeder.daemon = True
+    feeder.start()
+    if threads > 1:
+        tier_lock = TierLock()
+        pool = [threading.Thread(target=_run_worker_tasks,
+                                 args=(session, items, task_queue, state, stream, slot, tier_lock))
+                for slot in range(threads)]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
     else:
-        for i, item in enumerate(items):
-            nextitem = items[i + 1] if i + 1 < len(items) else None
-            item.config.hook.pytest_runtest_protocol(item=item, nextitem=nextitem)
-            if session.shouldstop:
-                raise session.Interrupted(session.shouldstop)
+        _run_worker_tasks(session, items, task_queue, state, stream)
+    try:
+        # a worker which retired or stopped early still holds the fixtures of its last item
+        session._setupstate.teardown_all()
+    finally:
+        stream.close()
 
 
-def _run_next_item(session, item, i):
-    nextitem = session.items[i + 1] if i + 1 < len(session.items) else None
-    item.config.hook.pytest_runtest_protocol(item=item, nextitem=nextitem)
+def _feed_worker_tasks(task_reader, task_queue, threads):
+    '''Move the batches sent by the parent process to the queue of the worker threads'''
+    try:
+        while True:
+            task_queue.put(task_reader.recv())
+    except (EOFError, OSError):
+        for _ in range(threads):
+            task_queue.put(None)
+
+
+def _run_worker_tasks(session, items, task_queue, state, stream, slot=0, tier_lock=None):
+    '''Task loop of a worker process (or of a thread of a hybrid worker process).
+
+    The following batch is fetched right before the teardown of the last item
+    of the current one, so pytest's SetupState knows which fixtures are still
+    needed afterwards. When no batch is queued yet (e.g. a group waits for the
+    current one), the last item is torn down completely, like at the end of a group.
+    Once the parent sets the stopped flag (-x, --maxfail) or the worker retires,
+    no further item is started.
+    '''
+    # a killed worker loses its buffered reports, these items would have to run again
+    flush_items = any(_item_timeout(item) is not None for item in items)
+    task = task_queue.get()
+    while task is not None:
+        batch, urgent, exclusive = task
+        fetched = []
+
+        def lookahead():
+            try:
+                fetched.append(task_queue.get_nowait())
+            except queue.Empty:
+                # the parent hands out the next batch once it has the reports of the previous ones
+                stream.flush()
+                try:
+                    fetched.append(task_queue.get(timeout=LOOKAHEAD_TIMEOUT))
+                except queue.Empty:
+                    fetched.append(False)
+            return items[fetched[0][0][0]] if fetched[0] else None
+
+        if tier_lock is not None:
+            tier_lock.acquire(exclusive)
+        try:
+            for position, index in enumerate(batch):
+                if state.stopping:
+                    break
+                state.start(slot, index)
+                if position + 1 < len(batch):
+                    reports = _run_protocol(items[index], nextitem=items[batch[position + 1]])
+                else:
+                    reports = _run_protocol(items[index], lookahead=lookahead)
+                state.finish(slot)
+                stream.add(index, reports)
+                if flush_items:
+                    stream.flush()
+        finally:
+            if tier_lock is not None:
+                tier_lock.release(exclusive)
+        if state.stopping:
+            break
+        if urgent or fetched == [False]:
+            # other groups are waiting for this batch or this worker is about to wait for more work
+            stream.flush()
+        task = fetched[0] if fetched != [False] else task_queue.get()
+
+
+class WorkerState(object):
+    '''The state a worker process shares with the parent process (see ProcWorker)'''
+
+    def __init__(self, stopped, current, usage):
+        self.stopped = stopped
+        self.current = current
+        self.usage = usage
+        self.max_tests = None
+        self.max_rss = None
+        self.process = None
+        self.lock = None
+
+    def set_limits(self, config):
+        import psutil
+        self.max_tests = config.option.concurrent_max_tests
+        self.max_rss = config.option.concurrent_max_rss * MIB if config.option.concurrent_max_rss else None
+        self.process = psutil.Process()
+        self.lock = threading.Lock()
+        self.usage[1] = self.process.memory_info().rss
+        self.measure_memory()
+
+    @property
+    def stopping(self):
+        return self.stopped.value or self.usage[2]
+
+    def measure_memory(self):
+        '''Publish the private (USS) and shared part of the RSS of the worker, at its peak RSS'''
+        try:
+            memory = self.process.memory_full_info()
+        except Exception:
+            # e.g. psutil.AccessDenied, the summary leaves the worker out
+            return
+        self.usage[4] = memory.uss
+        self.usage[5] = memory.rss - memory.uss
+
+    def start(self, slot, index):
+        self.current[2 * slot + 1] = time.time()
+        self.current[2 * slot] = index
+
+    def finish(self, slot):
+        self.current[2 * slot] = -1
+        with self.lock:
+            self.usage[0] += 1
+            rss = self.process.memory_info().rss
+            if rss > self.usage[1]:
+                self.usage[1] = rss
+                self.measure_memory()
+            if (self.max_tests and self.usage[0] >= self.max_tests) or (self.max_rss and rss > self.max_rss):
+                self.usage[2] = 1
+
+
+class TierLock(object):
+    '''Lets thread tier batches share a hybrid worker process, while a process
+    tier batch runs alone in it. Waiting process tier batches go first.'''
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.shared = 0
+        self.exclusive = False
+        self.waiting = 0
+
+    def acquire(self, exclusive):
+        with self.condition:
+            if exclusive:
+                self.waiting += 1
+                while self.exclusive or self.shared:
+                    self.condition.wait()
+                self.waiting -= 1
+                self.exclusive = True
+            else:
+                while self.exclusive or self.waiting:
+                    self.condition.wait()
+                self.shared += 1
+
+    def release(self, exclusive):
+        with self.condition:
+            if exclusive:
+                self.exclusive = False
+            else:
+                self.shared -= 1
+            self.condition.notify_all()
+
+
+def _run_protocol(item, nextitem=None, lookahead=None):
+    '''Run the pytest_runtest_protocol hook of an item without logging its reports, which are returned.
+
+    The hook wrappers of other plugins (e.g. filterwarnings of the warnings
+    plugin) still wrap the test protocol, the reports are logged where they
+    are merged instead. With lookahead, the following item is only asked for
+    right before the teardown.
+    '''
+    item._concurrent_protocol = [nextitem, lookahead, []]
+    try:
+        item.ihook.pytest_runtest_protocol(item=item, nextitem=nextitem)
+        return item._concurrent_protocol[2]
+    finally:
+        del item._concurrent_protocol
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_runtest_protocol(item, nextitem):
+    protocol = getattr(item, '_concurrent_protocol', None)
+    if protocol is None:
+        return None
+    nextitem, lookahead, reports = protocol
+    if lookahead is not None:
+        reports.extend(_runtestprotocol_lookahead(item, lookahead))
+    else:
+        reports.extend(runtestprotocol(item, log=False, nextitem=nextitem))
+    return True
+
+
+def _runtestprotocol_lookahead(item, lookahead):
+    '''Same as runtestprotocol(log=False), but the following item is only
+    asked for right before the teardown'''
+    hasrequest = hasattr(item, "_request")
+    if hasrequest and not item._request:
+        item._initrequest()
+    rep = call_and_report(item, "setup", False)
+    reports = [rep]
+    if rep.passed:
+        if item.config.option.setupshow:
+            show_test_item(item)
+        if not item.config.option.setuponly:
+            reports.append(call_and_report(item, "call", False))
+    reports.append(call_and_report(item, "teardown", False, nextitem=lookahead()))
+    if hasrequest:
+        item._request = False
+        item.funcargs = None
+    return reports
+
+
+def _log_item_reports(item, reports):
+    '''Replay the logging hooks of an item which ran in another process (or thread)'''
+    item.ihook.pytest_runtest_logstart(nodeid=item.nodeid, location=item.location)
+    for report in reports:
+        item.ihook.pytest_runtest_logreport(report=report)
+    if hasattr(item.ihook, 'pytest_runtest_logfinish'):
+        item.ihook.pytest_runtest_logfinish(nodeid=item.nodeid, location=item.location)
+
+
+def _report_to_record(report):
+    '''Turn a TestReport into a compact picklable record'''
+    return dict((key, value) for key, value in report.__dict__.items()
+                if key not in REPORT_DEFAULTS or value != REPORT_DEFAULTS[key])
+
+
+def _record_to_report(record):
+    report = TestReport.__new__(TestReport)
+    report.__dict__.update(longrepr=None, sections=[], duration=0, user_properties=[])
+    report.__dict__.update(record)
+    return report
+
+
+class ReportStream(object):
+    '''Buffers the reports of a worker process and sends them in batches over a pipe.
+
+    Every batch also carries the amount of shared fixture setups since the last one.
+    Failures are sent right away, the parent stops dispatching on them (-x, --maxfail).
+    '''
+
+    def __init__(self, writer, fixture_setups=None):
+        self.writer = writer
+        self.fixture_setups = fixture_setups or (lambda: 0)
+        self.sent_setups = self.fixture_setups()
+        self.buffer = []
+        self.last_flush = time.time()
+        self.lock = threading.Lock()
+
+    def add(self, index, reports):
+        with self.lock:
+            self.buffer.append((index, [_report_to_record(report) for report in reports]))
+            if len(self.buffer) >= REPORT_BATCH_SIZE or any(report.failed for report in reports) or \
+                    time.time() - self.last_flush >= REPORT_FLUSH_INTERVAL:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        setups = self.fixture_setups()
+        if self.buffer or setups != self.sent_setups:
+            self.writer.send((self.buffer, setups - self.sent_setups))
+            self.buffer = []
+            self.sent_setups = setups
+        self.last_flush = time.time()
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    '''Run coroutine test functions on the event loop of asyncio mode'''
+    awaited = getattr(pyfuncitem, '_concurrent_awaited', None)
+    if awaited is not None:
+        # CoroutineRunner awaited it already, the call phase only reports how that went
+        if awaited[2] is not None:
+            raise awaited[2]
+        return True
+
+    loop = getattr(pyfuncitem.config, '_concurrent_loop', None)
+    if loop is None or not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+
+    import asyncio
+    asyncio.run_coroutine_threadsafe(pyfuncitem.obj(**_test_arguments(pyfuncitem)), loop).result()
+    return True
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_makereport(item, call):
+    awaited = getattr(item, '_concurrent_awaited', None)
+    if awaited is not None and call.when == 'call':
+        # the call phase of an awaited coroutine took as long as awaiting it
+        call.start, call.stop = awaited[0], awaited[1]
+    yield
+
+
+def _test_arguments(pyfuncitem):
+    funcargs = pyfuncitem.funcargs
+    return dict((arg, funcargs[arg]) for arg in pyfuncitem._fixtureinfo.argnames)
+
+
+class CoroutineRunner(object):
+    '''Runs the batches of asyncio mode, driven by callbacks on its event loop.
+
+    Synchronous items run their whole test protocol in the thread pool. Coroutine
+    test functions are set up and torn down in the thread pool as well, but the
+    coroutine itself is awaited on the loop, at most `limit` of them at a time,
+    without holding a thread. Awaited items do not go through the
+    pytest_runtest_protocol hook, whose wrappers could only wrap them by holding
+    a thread. Items with a timeout, xfail(run=False) items and filterwarnings
+    items run like synchronous ones.
+    '''
+
+    def __init__(self, session, loop, executor, limit):
+        self.session = session
+        self.loop = loop
+        self.executor = executor
+        self.limit = limit
+        self.semaphore = None
+
+    def run_batch(self, batch, nextitem):
+        '''Future of the batch, done once its last item finished or the session has to stop'''
+        done = self.loop.create_future()
+        self.loop.call_soon(self._next, done, list(zip(batch, batch[1:] + [nextitem])))
+        return done
+
+    def awaitable(self, item):
+        if not inspect.iscoroutinefunction(getattr(item, 'obj', None)) or _item_timeout(item) is not None:
+            return False
+        if item.get_marker('filterwarnings') is not None:
+            # the warnings plugin applies them in its pytest_runtest_protocol wrapper
+            return False
+        xfail = item.get_marker('xfail')
+        return xfail is None or xfail.kwargs.get('run', True)
+
+    def _then(self, future, done, callback):
+        '''Call callback(future) once the future is done, what it raises fails the batch'''
+        def resolved(future):
+            if done.done():
+                return
+            try:
+                callback(future)
+            except BaseException as error:
+                done.set_exception(error)
+        future.add_done_callback(resolved)
+
+    def _next(self, done, items, previous=None):
+        if previous is not None:
+            try:
+                previous.result()
+            except (self.session.Failed, self.session.Interrupted):
+                # the batch stops right below
+                pass
+        if not items or _stop_reason(self.session):
+            done.set_result(None)
+            return
+        item, nextitem = items.pop(0)
+        if self.awaitable(item):
+            setup = self.loop.run_in_executor(self.executor, _setup_coroutine_item, item)
+            self._then(setup, done, lambda setup: self._await(done, items, item, nextitem) if setup.result()
+                       else self._teardown(done, items, item, nextitem, False))
+        else:
+            protocol = self.loop.run_in_executor(self.executor, _run_next_item, self.session, item, nextitem)
+            self._then(protocol, done, lambda protocol: self._next(done, items, protocol))
+
+    def _await(self, done, items, item, nextitem):
+        import asyncio
+        if self.semaphore is None:
+            # created on the loop, older versions bind it to the current event loop
+            self.semaphore = asyncio.Semaphore(self.limit)
+
+        def start():
+            item._concurrent_awaited = [time.time(), None, None]
+            try:
+                coroutine = asyncio.ensure_future(item.obj(**_test_arguments(item)), loop=self.loop)
+            except Exception as error:
+                finish(error)
+            else:
+                # the outcome of the test, which the call phase reports
+                self._then(coroutine, done, lambda coroutine: finish(
+                    asyncio.CancelledError() if coroutine.cancelled() else coroutine.exception()))
+
+        def finish(error):
+            self.semaphore.release()
+            item._concurrent_awaited[1:] = [time.time(), error]
+            self._teardown(done, items, item, nextitem, True)
+
+        self._then(asyncio.ensure_future(self.semaphore.acquire(), loop=self.loop), done, lambda acquired: start())
+
+    def _teardown(self, done, items, item, nextitem, called):
+        teardown = self.loop.run_in_executor(self.executor, _finish_coroutine_item, item, nextitem, called)
+        self._then(teardown, done, lambda teardown: self._next(done, items, teardown))
+
+
+def _setup_coroutine_item(item):
+    '''The start of the test protocol of a coroutine item, whether its coroutine is to be awaited'''
+    item.ihook.pytest_runtest_logstart(nodeid=item.nodeid, location=item.location)
+    if hasattr(item, '_request') and not item._request:
+        item._initrequest()
+    report = call_and_report(item, 'setup')
+    if report.passed and item.config.option.setupshow:
+        show_test_item(item)
+    return report.passed and not item.config.option.setuponly
+
+
+def _finish_coroutine_item(item, nextitem, called):
+    '''The rest of the test protocol of a coroutine item, once it was awaited'''
+    try:
+        if called:
+            call_and_report(item, 'call')
+        call_and_report(item, 'teardown', nextitem=nextitem)
+    finally:
+        item._concurrent_awaited = None
+        if hasattr(item, '_request'):
+            item._request = False
+            item.funcargs = None
+    if hasattr(item.ihook, 'pytest_runtest_logfinish'):
+        item.ihook.pytest_runtest_logfinish(nodeid=item.nodeid, location=item.location)
+
+
+def _run_batch(session, batch, nextitem):
+    for item, following in zip(batch, batch[1:] + [nextitem]):
+        _run_next_item(session, item, following)
+
+
+def _run_next_item(session, item, nextitem):
+    timeout = _item_timeout(item)
+    if timeout is None:
+        item.config.hook.pytest_runtest_protocol(item=item, nextitem=nextitem)
+    else:
+        _run_with_timeout(item, nextitem, timeout)
+    _check_stop(session)
+
+
+def _run_with_timeout(item, nextitem, timeout):
+    '''Run an item in a daemon thread and stop waiting for it after timeout seconds.
+
+    Threads cannot be killed: a timed out item is reported as an error and left
+    running in the background, while its worker moves on with the next item.
+    An item whose test protocol raised is reported as an error as well.
+    '''
+    results = []
+
+    def run():
+        try:
+            results.extend(_run_protocol(item, nextitem=nextitem))
+        except BaseException:
+            results.extend(_error_reports(item, 'The test protocol raised\n%s' % traceback.format_exc(),
+                                          time.time() - started))
+
+    runner = threading.Thread(target=run)
+    runner.daemon = True
+    started = time.time()
+    runner.start()
+    runner.join(timeout)
+    if runner.is_alive():
+        reports = _error_reports(item, 'Timeout: the test ran longer than %ss, it was left running in the background'
+                                 % timeout, time.time() - started)
+    else:
+        reports = results
+    _log_item_reports(item, reports)
+
+
+def _stop_reason(session):
+    '''Why the session has to stop early (-x, --maxfail), if it has to'''
+    return getattr(session, 'shouldfail', False) or session.shouldstop
+
+
+def _check_stop(session):
+    # shouldfail is only set by pytest>=3.4
+    if getattr(session, 'shouldfail', False):
+        raise session.Failed(session.shouldfail)
     if session.shouldstop:
         raise session.Interrupted(session.shouldstop)
 
 
+class GroupScheduler(object):
+    '''Decides the order and the batches items of a group are dispatched in.
+
+    Items can be ordered by their historical duration (longest first), which
+    is summed over setup, call and teardown and kept in pytest's cache between
+    runs. Items without history are estimated with the median of the known
+    durations.
+
+    Items can also be ordered failures first: the ones which failed in the last
+    run (pytest's lastfailed), then the ones with the highest failure score, which
+    decays every run so recently flaky items come before long fixed ones, the
+    shortest first among them. The time until the first failure is reported.
+
+    Items of a module which use module or class scoped fixtures can be batched,
+    so that these fixtures are set up once per batch instead of once per item.
+    '''
+
+    CACHE_KEY = 'concurrent/durations'
+    FAILURES_KEY = 'concurrent/failures'
+
+    def __init__(self, config):
+        self.config = config
+        self.cache = getattr(config, 'cache', None)
+        self.durations = self.cache.get(self.CACHE_KEY, {}) if self.cache is not None else {}
+        known = sorted(self.durations.values())
+        self.median = known[len(known) // 2] if known else 0.0
+        self.lastfailed = self.cache.get('cache/lastfailed', {}) if self.cache is not None else {}
+        self.failures = self.cache.get(self.FAILURES_KEY, {}) if self.cache is not None else {}
+        self.current = collections.defaultdict(float)
+        self.failed = set()
+        self.session_start = time.time()
+        self.first_failure = None  # (seconds since the session started, nodeid)
+        self.makespans = []
+        self.fixture_setups = 0
+        self.fixture_uses = 0
+        self.positions = {}
+        self.taken = 0
+        self.stolen = 0
+        self.lock = threading.Lock()
+
+    def estimate(self, nodeid):
+        return self.durations.get(nodeid, self.median)
+
+    def order(self, items):
+        mode = self.config.option.concurrent_order or self.config.getini('concurrent_order') or 'collection'
+        if mode not in ['collection', 'duration', 'failures']:
+            raise NotImplementedError('Concurrent order %s is not supported (available: collection, duration, failures).' % mode)
+        if mode == 'duration':
+            # sorted is stable, so items with the same estimate keep the collection order
+            return sorted(items, key=lambda item: -self.estimate(item.nodeid))
+        if mode == 'failures':
+            return sorted(items, key=self.failure_rank)
+        return items
+
+    def failure_rank(self, item):
+        lastfailed = item.nodeid in self.lastfailed
+        score = self.failures.get(item.nodeid, 0.0)
+        return (not lastfailed, -score, self.estimate(item.nodeid) if lastfailed or score else 0.0)
+
+    def batch(self, items):
+        '''Split items into the batches that are dispatched to workers.
+
+        Batches keep the position of their first item and the collection order
+        of their items, so shared fixtures are torn down only after the last one.
+        '''
+        if not _get_batch(self.config):
+            return [[item] for item in items]
+
+        batches = []
+        modules = {}
+        for item in items:
+            key = _batch_key(item)
+            if key is None:
+                batches.append([item])
+            elif key in modules:
+                modules[key].append(item)
+            else:
+                modules[key] = [item]
+                batches.append(modules[key])
+        for batch in batches:
+            batch.sort(key=lambda item: self.positions.get(item, 0))
+        return batches
+
+    def add_fixture_setups(self, amount):
+        with self.lock:
+            self.fixture_setups += amount
+
+    def predict_makespan(self, items, workers):
+        '''Makespan of the items when greedily handed to the first idle worker in order'''
+        loads = [0.0] * workers
+        for item in items:
+            loads[loads.index(min(loads))] += self.estimate(item.nodeid)
+        return max(loads) if loads else 0.0
+
+    def add_makespan(self, group, predicted, actual):
+        self.makespans.append((group, predicted, actual))
+
+    def pytest_sessionstart(self):
+        self.session_start = time.time()
+
+    def pytest_runtest_logreport(self, report):
+        self.current[report.nodeid] += report.duration
+        if report.failed:
+            with self.lock:
+                self.failed.add(report.nodeid)
+                if self.first_failure is None:
+                    self.first_failure = (time.time() - self.session_start, report.nodeid)
+
+    def pytest_fixture_setup(self, fixturedef):
+        if fixturedef.scope in ('module', 'class'):
+            self.add_fixture_setups(1)
+
+    def pytest_collection_finish(self, session):
+        self.positions = dict((item, position) for position, item in enumerate(session.items))
+        self.fixture_uses = sum(len(_shared_fixtures(item)) for item in session.items)
+
+    def pytest_sessionfinish(self):
+        if self.cache is not None and self.current:
+            durations = dict(self.durations)
+            durations.update(self.current)
+            self.cache.set(self.CACHE_KEY, durations)
+
+            failures = dict(self.failures)
+            for nodeid in self.current:
+                score = failures.get(nodeid, 0.0) * FAILURE_DECAY + (nodeid in self.failed)
+                if score >= FAILURE_FORGET:
+                    failures[nodeid] = score
+                else:
+                    failures.pop(nodeid, None)
+            self.cache.set(self.FAILURES_KEY, failures)
+
+    def add_stealing(self, stealing):
+        with self.lock:
+            self.taken += stealing.taken
+            self.stolen += stealing.stolen
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if self.first_failure is not None and _get_mode(self.config):
+            terminalreporter.write_sep('=', 'concurrent first failure')
+            terminalreporter.write_line('first failure after %.2fs: %s' % self.first_failure)
+        if _get_steal(self.config) and self.taken:
+            terminalreporter.write_sep('=', 'concurrent work stealing')
+            terminalreporter.write_line('%d of %d batches stolen from busier workers' % (self.stolen, self.taken))
+        if _get_batch(self.config):
+            terminalreporter.write_sep('=', 'concurrent fixture batching')
+            terminalreporter.write_line('%d module/class fixture setups for %d uses, %d saved' % (
+                self.fixture_setups, self.fixture_uses, max(0, self.fixture_uses - self.fixture_setups)))
+        if not self.config.option.concurrent_makespan or not self.makespans:
+            return
+        terminalreporter.write_sep('=', 'concurrent makespan')
+        for group, predicted, actual in self.makespans:
+            terminalreporter.write_line('group %s: predicted %.2fs, actual %.2fs' % (group, predicted, actual))
+
+
+class ThreadCapture(object):
+    '''sys.stdout or sys.stderr of the mthread test loop: what a thread writes while
+    it runs a test phase goes to the buffer of the phase, the rest to the stream it replaced'''
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffers = {}  # thread ident -> SpooledTemporaryFile
+
+    def start(self):
+        self.buffers[get_ident()] = tempfile.SpooledTemporaryFile(CAPTURE_SPOOL_SIZE)
+
+    def stop(self):
+        '''The output of the phase the current thread ran, the middle of outputs over CAPTURE_SPOOL_SIZE is left out'''
+        buffer = self.buffers.pop(get_ident(), None)
+        if buffer is None:
+            return ''
+        size = buffer.tell()
+        buffer.seek(0)
+        if size <= CAPTURE_SPOOL_SIZE:
+            data = buffer.read()
+        else:
+            half = CAPTURE_SPOOL_SIZE // 2
+            data = buffer.read(half)
+            buffer.seek(size - half)
+            data += ('\n... %d bytes of output left out ...\n' % (size - 2 * half)).encode() + buffer.read()
+        buffer.close()
+        return data.decode('utf-8', 'replace')
+
+    def write(self, data):
+        buffer = self.buffers.get(get_ident())
+        if buffer is None:
+            return self.stream.write(data)
+        buffer.write(data if isinstance(data, bytes) else data.encode('utf-8', 'replace'))
+        return len(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        if get_ident() not in self.buffers:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class ThreadCaptureManager(CaptureManager):
+    '''Captures the output of every test phase per thread in mthread mode.
+
+    pytest's capture manager captures the whole process in one buffer, so the
+    output of concurrent tests ends up on whichever report reads it first. For
+    the test loop sys.stdout and sys.stderr are ThreadCapture streams instead,
+    the global capture stays suspended. Output written to the file descriptors
+    directly (subprocesses, C extensions) or by threads a test starts is not
+    captured, capsys and capfd still replace the streams of the whole process.
+    '''
+
+    def __init__(self, capman):
+        # the global capturing is shared with (and stopped through) the replaced capture manager
+        self.capman = capman
+        self._method = capman._method
+        self.out = self.err = None
+
+    @property
+    def _global_capturing(self):
+        return self.capman._global_capturing
+
+    @_global_capturing.setter
+    def _global_capturing(self, capturing):
+        self.capman._global_capturing = capturing
+
+    def _route(self):
+        # suspending or resuming the global capture (e.g. live logging) replaces the streams
+        if self.out is not None:
+            if sys.stdout is not self.out:
+                self.out.stream, sys.stdout = sys.stdout, self.out
+            if sys.stderr is not self.err:
+                self.err.stream, sys.stderr = sys.stderr, self.err
+
+    @staticmethod
+    def supports(capman):
+        '''Whether the capture manager has the private API this one builds on (pytest 3.3 up to 5.3)'''
+        if not all(hasattr(capman, name) for name in ('_method', '_global_capturing', 'resume_global_capture',
+                                                      'suspend_global_capture', 'activate_fixture', 'deactivate_fixture')):
+            return False
+        # later versions (de)activate the capture fixture of the current item without taking it
+        return all(getattr(capman, name).__func__.__code__.co_argcount == 2
+                   for name in ('activate_fixture', 'deactivate_fixture'))
+
+    def resume_global_capture(self, *args, **kwargs):
+        CaptureManager.resume_global_capture(self, *args, **kwargs)
+        self._route()
+
+    def suspend_global_capture(self, *args, **kwargs):
+        # (item=None, in_=False) before pytest 3.7, (in_=False) since
+        outerr = CaptureManager.suspend_global_capture(self, *args, **kwargs)
+        self._route()
+        return outerr
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtestloop(self, session):
+        self.out, self.err = ThreadCapture(sys.stdout), ThreadCapture(sys.stderr)
+        self._route()
+        try:
+            yield
+        finally:
+            sys.stdout, sys.stderr = self.out.stream, self.err.stream
+            self.out = self.err = None
+
+    def stop_item(self, item, when):
+        self.deactivate_fixture(item)
+        item.add_report_section(when, 'stdout', self.out.stop())
+        item.add_report_section(when, 'stderr', self.err.stop())
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_setup(self, item):
+        self.out.start()
+        self.err.start()
+        yield
+        self.stop_item(item, 'setup')
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_call(self, item):
+        self.out.start()
+        self.err.start()
+        self.activate_fixture(item)
+        yield
+        self.stop_item(item, 'call')
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_teardown(self, item):
+        self.out.start()
+        self.err.start()
+        self.activate_fixture(item)
+        yield
+        self.stop_item(item, 'teardown')
+
+
+class ConcurrentTracer(object):
+    '''Records when every phase of every item ran, on which worker, for --conctrace.
+
+    The timestamps and the worker (process and thread or greenlet) are attached
+    to the reports where the phase runs, so they reach the parent process with
+    the reports of mproc workers. The trace gets one track per worker plus one
+    per group, from the moment it could start to the moment all its items finished.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.phases = []  # (nodeid, when, start, stop, pid, thread)
+        self.groups = []  # (group, nodeids, start, stop)
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_makereport(self, item, call):
+        outcome = yield
+        outcome.get_result().concurrent_trace = (call.start, call.stop, os.getpid(), threading.current_thread().ident)
+
+    def pytest_runtest_logreport(self, report):
+        trace = getattr(report, 'concurrent_trace', None)
+        if trace is not None:
+            self.phases.append((report.nodeid, report.when) + tuple(trace))
+
+    def add_groups(self, graph):
+        for group, batches in graph.plan.items():
+            if group in graph.finished:
+                nodeids = [item.nodeid for batch in batches for item in batch]
+                self.groups.append((group, nodeids, graph.started[group], graph.finished[group]))
+
+    def efficiency(self):
+        '''(workers, busy seconds, wall seconds) of the workers which ran items'''
+        if not self.phases:
+            return 0, 0, 0
+        workers = set((pid, thread) for _, _, _, _, pid, thread in self.phases)
+        busy = sum(stop - start for _, _, start, stop, _, _ in self.phases)
+        wall = max(phase[3] for phase in self.phases) - min(phase[2] for phase in self.phases)
+        return len(workers), busy, wall
+
+    def events(self):
+        origin = min([phase[2] for phase in self.phases] + [group[2] for group in self.groups] or [0])
+        group_of = dict((nodeid, str(group)) for group, nodeids, _, _ in self.groups for nodeid in nodeids)
+        events = []
+        for pid in sorted(set(phase[4] for phase in self.phases)):
+            name = 'pytest' if pid == os.getpid() else 'worker %d' % pid
+            events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': name}})
+        for nodeid, when, start, stop, pid, thread in self.phases:
+            events.append({'name': nodeid, 'cat': when, 'ph': 'X', 'pid': pid, 'tid': thread,
+                           'ts': (start - origin) * 1e6, 'dur': (stop - start) * 1e6,
+                           'args': {'phase': when, 'group': group_of.get(nodeid)}})
+        # the groups are shown as a separate process, one track per group
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': 0, 'args': {'name': 'concurrent groups'}})
+        for index, (group, nodeids, start, stop) in enumerate(self.groups):
+            events.append({'name': str(group), 'cat': 'group', 'ph': 'X', 'pid': 0, 'tid': index,
+                           'ts': (start - origin) * 1e6, 'dur': (stop - start) * 1e6, 'args': {'items': len(nodeids)}})
+        return events
+
+    def pytest_sessionfinish(self):
+        with open(self.path, 'w') as trace:
+            json.dump({'traceEvents': self.events(), 'displayTimeUnit': 'ms'}, trace)
+
+    def pytest_terminal_summary(self, terminalreporter):
+        workers, busy, wall = self.efficiency()
+        terminalreporter.write_sep('=', 'concurrent trace')
+        terminalreporter.write_line('trace written to %s' % self.path)
+        terminalreporter.write_line('%d workers busy %.2fs in %.2fs, parallel efficiency %.0f%%' % (
+            workers, busy, wall, 100.0 * busy / (workers * wall) if workers and wall else 0))
+        for group, nodeids, start, stop in self.groups:
+            terminalreporter.write_line('group %s: %d items in %.2fs' % (group, len(nodeids), stop - start))
+
+
+@pytest.hookimpl(trylast=True)
+def pytest_collection_modifyitems(session, config, items):
+    '''Deselect the items of the other shards with --concshard'''
+    path = config.option.concurrent_shard_file
+    if config.option.concurrent_shard_plan:
+        config._concurrent_shards = _plan_shards(items, config.option.concurrent_shard_plan, config._concurrent_scheduler)
+        if path:
+            _write_shard_plan(path, config._concurrent_shards[0])
+    if not config.option.concurrent_shard:
+        return
+    index, total = _parse_shard(config.option.concurrent_shard)
+    if path:
+        shards = _read_shard_plan(path, items, total, config._concurrent_scheduler)
+    else:
+        # the durations in the cache of every machine differ, only the collected items are the same
+        shards, _ = _plan_shards(items, total, config._concurrent_scheduler, durations=False)
+    selected = set(shards[index - 1])
+    deselected = [item for item in items if item not in selected]
+    if deselected:
+        config.hook.pytest_deselected(items=deselected)
+        items[:] = [item for item in items if item in selected]
+
+
+def _parse_shard(shard):
+    '''Parse the INDEX/TOTAL of --concshard'''
+    index, _, total = shard.partition('/')
+    try:
+        index, total = int(index), int(total)
+    except ValueError:
+        raise ValueError('Concurrent shard can only be INDEX/TOTAL integers (e.g. 1/4).')
+    if not 1 <= index <= total:
+        raise ValueError('Concurrent shard index needs to be between 1 and %d.' % total)
+    return index, total
+
+
+def _shard_units(items, scheduler):
+    '''Items which go to the same shard, by their module with --concbatch, one by one otherwise'''
+    batch = _get_batch(scheduler.config)
+    units = collections.OrderedDict()
+    for item in items:
+        key = (_batch_key(item) if batch else None) or item.nodeid
+        units.setdefault(key, []).append(item)
+    return units
+
+
+def _plan_shards(items, total, scheduler, durations=True):
+    '''Split items into total shards which take about the same time.
+
+    The longest units go first, each to the shard with the least duration so
+    far. A unit is an item, or the items of a module which are batched together
+    with --concbatch. Ties are broken by nodeid and shard number, so without
+    durations every machine which collects the same items plans the same
+    shards. Every shard keeps the collection order, which its groups are built
+    from.
+    '''
+    units = _shard_units(items, scheduler)
+    if durations:
+        costs = dict((key, sum(scheduler.estimate(item.nodeid) for item in unit)) for key, unit in units.items())
+    else:
+        costs = dict((key, float(len(unit))) for key, unit in units.items())
+
+    shards = [set() for _ in range(total)]
+    loads = [0.0] * total
+    for key in sorted(units, key=lambda key: (-costs[key], key)):
+        # without known durations the shards get the same amount of units
+        shard = min(range(total), key=lambda shard: (loads[shard], len(shards[shard])))
+        shards[shard].update(units[key])
+        loads[shard] += costs[key]
+    return [[item for item in items if item in shard] for shard in shards], loads
+
+
+def _write_shard_plan(path, shards):
+    '''Write the nodeids of every shard for --concshard --concshardfile on other machines'''
+    with open(path, 'w') as plan:
+        json.dump([[item.nodeid for item in items] for items in shards], plan, indent=2)
+
+
+def _read_shard_plan(path, items, total, scheduler):
+    '''Split items into the shards of a --concshardplan file.
+
+    Units which are not in the plan, like tests added since it was written, go
+    to a shard by a stable hash of their nodeid, the same one on every machine.
+    '''
+    with open(path) as plan:
+        planned = json.load(plan)
+    if len(planned) != total:
+        raise ValueError('Concurrent shard plan %s has %d shards, not %d.' % (path, len(planned), total))
+    shard_of = dict((nodeid, index) for index, nodeids in enumerate(planned) for nodeid in nodeids)
+
+    shards = [set() for _ in range(total)]
+    for key, unit in _shard_units(items, scheduler).items():
+        known = [shard_of[item.nodeid] for item in unit if item.nodeid in shard_of]
+        if not known:
+            # masked, python 2 returns a signed crc
+            known = [(zlib.crc32(key if isinstance(key, bytes) else key.encode('utf-8')) & 0xffffffff) % total]
+        shards[known[0]].update(unit)
+    return [[item for item in items if item in shard] for shard in shards]
+
+
+def pytest_terminal_summary(terminalreporter):
+    shards = getattr(terminalreporter.config, '_concurrent_shards', None)
+    if shards is None:
+        return
+    terminalreporter.write_sep('=', 'concurrent shard plan')
+    for index, (items, load) in enumerate(zip(*shards)):
+        terminalreporter.write_line('shard %d/%d: %d tests, %.2fs' % (index + 1, len(shards[0]), len(items), load))
+        for item in items:
+            terminalreporter.write_line('    %s' % item.nodeid)
+    path = terminalreporter.config.option.concurrent_shard_file
+    if path:
+        terminalreporter.write_line('plan written to %s' % path)
+
+
+def _shared_fixtures(item):
+    '''Names of the module and class scoped fixtures an item uses'''
+    fixtureinfo = getattr(item, '_fixtureinfo', None)
+    if fixtureinfo is None:
+        return []
+    return [name for name, fixturedefs in fixtureinfo.name2fixturedefs.items()
+            if fixturedefs and fixturedefs[-1].scope in ('module', 'class')]
+
+
+def _batch_key(item):
+    '''Items with the same key share fixtures and are batched together'''
+    if not _shared_fixtures(item):
+        return None
+    module = item.getparent(pytest.Module)
+    return module.nodeid if module is not None else None
+
+
 @pytest.mark.trylast
 def pytest_configure(config):
     config.addinivalue_line(
         'markers',
-        'concgroup(group: int): concurrent group number to run tests in groups (smaller numbers are executed earlier)')
+        'concgroup(group, after=None): concurrent group number to run tests in groups (smaller numbers are executed earlier), '
+        'or group name which runs after the groups in "after" and concurrently with independent groups')
+    config.addinivalue_line(
+        'markers',
+        'conctier(tier): "thread" (default) or "process", process tier tests run alone in their worker process in hybrid mode')
+    config.addinivalue_line(
+        'markers',
+        'concresource(*names): resources shared with other tests, tests holding the same resource '
+        'do not run at the same time (see the concurrent_resources ini for capacities)')
 
-    if (config.option.concurrent_mode and config.option.concurrent_mode == 'mproc') or \
-            config.getini('concurrent_mode') == 'mproc':
+    config.addinivalue_line(
+        'markers',
+        'conctimeout(seconds): report the test as an error when it runs longer (overrides --conctimeout)')
+
+    config._concurrent_scheduler = GroupScheduler(config)
+    config.pluginmanager.register(config._concurrent_scheduler, 'concurrentscheduler')
+
+    if config.option.concurrent_trace:
+        config.pluginmanager.register(ConcurrentTracer(config.option.concurrent_trace), 'concurrenttracer')
+
+    # a remote or spawned worker only runs what its session hands out
+    spawned = any(isinstance(plugin, SpawnedWorker) for plugin in config.pluginmanager.get_plugins())
+    mode = None if config.option.concurrent_worker_connect or spawned else _get_mode(config)
+    if spawned and getattr(config, '_xml', None) is not None:
+        # the session writes the JUnit XML file
+        config.pluginmanager.unregister(config._xml)
+        config._xml = None
+    mproc = mode in ['mproc', 'hybrid', 'remote']
+    compact_stats = config.option.concurrent_compact_stats or config.getini('concurrent_compact_stats')
+    if (mproc or compact_stats) and not spawned:
+        # spawned workers run without the terminal plugin
         standard_reporter = config.pluginmanager.getplugin('terminalreporter')
-        concurrent_reporter = ConcurrentTerminalReporter(standard_reporter)
+        concurrent_reporter = ConcurrentTerminalReporter(standard_reporter, compact_stats)
 
         config.pluginmanager.unregister(standard_reporter)
         config.pluginmanager.register(concurrent_reporter, 'terminalreporter')
 
+    capman = config.pluginmanager.getplugin('capturemanager')
+    if mode == 'mthread' and isinstance(capman, CaptureManager) and ThreadCaptureManager.supports(capman) and capman._method != 'no':
+        config.pluginmanager.unregister(capman)
+        config.pluginmanager.register(ThreadCaptureManager(capman), 'capturemanager')
+
+    if mode == 'remote':
+        address = config.option.concurrent_serve or config.getini('concurrent_serve') or '127.0.0.1:0'
+        config._concurrent_pool = RemoteWorkerPool(config, address, config.option.concurrent_terminate)
+        config.pluginmanager.register(config._concurrent_pool, 'concurrentpool')
+    elif mproc:
+        config._concurrent_pool = ProcWorkerPool(config.option.concurrent_terminate)
+        config.pluginmanager.register(config._concurrent_pool, 'concurrentpool')
+
         if config.option.xmlpath is not None:
             xmlpath = config.option.xmlpath
             config.pluginmanager.unregister(config._xml)
@@ -233,9 +2728,51 @@ class ConcurrentNodeReporter(_NodeReporter):
 
     def finalize(self):
         data = self.to_xml()  # .unicode(indent=0)
+        stream = self.xml.stream
         self.__dict__.clear()
         self.to_xml = lambda: py.xml.raw(data)
-        NODEREPORTS.append(data)
+        stream.add(data)
+
+
+class JunitStream(object):
+    '''Writes the testcases of a JUnit XML file as they finish.
+
+    The file is a complete document after every testcase, the closing tag is
+    overwritten by the next one. The counts of the testsuite are only known
+    at the end, its start tag is padded to leave room for them.
+    '''
+
+    def __init__(self, logfile, suite_name):
+        self.suite_name = suite_name
+        self.file = open(logfile, 'wb')
+        self.header = self._start_tag(errors=0, failures=0, skips=0, tests=0, time='0.000')
+        self.file.write(b'<?xml version="1.0" encoding="utf-8"?>')
+        self.start = self.file.tell()
+        self.file.write(self.header + b' ' * JUNIT_HEADER_ROOM + b'>')
+        self.end = self.file.tell()
+        self._write_end()
+
+    def _start_tag(self, **counts):
+        suite = Junit.testsuite(py.xml.raw(''), name=self.suite_name, **counts).unicode(indent=0)
+        return suite[:suite.index('>')].encode('utf-8')
+
+    def _write_end(self):
+        self.file.write(b'</testsuite>')
+        self.file.flush()
+        self.file.seek(self.end)
+
+    def add(self, testcase):
+        self.file.write(testcase.encode('utf-8'))
+        self.end = self.file.tell()
+        self._write_end()
+
+    def close(self, properties, **counts):
+        if properties:
+            self.add(properties.unicode(indent=0))
+        header = self._start_tag(**counts)
+        self.file.seek(self.start)
+        self.file.write(header + b' ' * (len(self.header) + JUNIT_HEADER_ROOM - len(header)))
+        self.file.close()
 
 
 class ConcurrentLogXML(LogXML):
@@ -247,43 +2784,40 @@ class ConcurrentLogXML(LogXML):
         self.logfile = os.path.normpath(os.path.abspath(logfile))
         self.prefix = prefix
         self.suite_name = suite_name
-        self.stats = XMLSTATS
-        self.node_reporters = {}  # XMLREPORTER  # nodeid -> _NodeReporter
+        self.stats = dict.fromkeys(['error', 'passed', 'failure', 'skipped'], 0)
+        self.node_reporters = {}  # nodeid -> _NodeReporter
+        self.stream = None  # testcases are written as they finish
         self.node_reporters_ordered = []
         self.global_properties = []
         # List of reports that failed on call but teardown is pending.
         self.open_reports = []
         self.cnt_double_fail_tests = 0
 
-    def pytest_sessionfinish(self):
+    def pytest_sessionstart(self):
+        LogXML.pytest_sessionstart(self)
         dirname = os.path.dirname(os.path.abspath(self.logfile))
         if not os.path.isdir(dirname):
             os.makedirs(dirname)
-        logfile = open(self.logfile, 'w', encoding='utf-8')
+        self.stream = JunitStream(self.logfile, self.suite_name)
+
+    def pytest_sessionfinish(self):
         suite_stop_time = time.time()
         suite_time_delta = suite_stop_time - self.suite_start_time
 
         numtests = (self.stats['passed'] + self.stats['failure'] +
                     self.stats['skipped'] + self.stats['error'] -
                     self.cnt_double_fail_tests)
-        # print("NODE REPORTS: " + str(NODEREPORTS))
-        logfile.write('<?xml version="1.0" encoding="utf-8"?>')
-        logfile.write(Junit.testsuite(
+        self.stream.close(
             self._get_global_properties_node(),
-            [concurrent_log_to_xml(x) for x in NODEREPORTS],
-            name=self.suite_name,
             errors=self.stats['error'],
             failures=self.stats['failure'],
             skips=self.stats['skipped'],
             tests=numtests,
-            time="%.3f" % suite_time_delta, ).unicode(indent=0))
-        logfile.close()
+            time="%.3f" % suite_time_delta)
 
     def add_stats(self, key):
-        XMLLOCK.acquire()
         if key in self.stats:
             self.stats[key] += 1
-        XMLLOCK.release()
 
     def node_reporter(self, report):
         nodeid = getattr(report, 'nodeid', report)
@@ -291,7 +2825,6 @@ class ConcurrentLogXML(LogXML):
         slavenode = getattr(report, 'node', None)
 
         key = nodeid, slavenode
-        # NODELOCK.acquire()
         if key in self.node_reporters:
             # TODO: breasks for --dist=each
             return self.node_reporters[key]
@@ -299,7 +2832,6 @@ class ConcurrentLogXML(LogXML):
         reporter = ConcurrentNodeReporter(nodeid, self)
 
         self.node_reporters[key] = reporter
-        # NODEREPORTS.append(reporter.to_xml())
         return reporter
 
     def pytest_terminal_summary(self, terminalreporter):
@@ -307,27 +2839,77 @@ class ConcurrentLogXML(LogXML):
                                    "generated xml file: %s" % (self.logfile))
 
 
+class CompactReports(object):
+    '''A category of the terminal stats which only counts its reports.
+
+    Reports appended with keep=True are kept whole, --durations gets the
+    nodeid, phase and duration of the other ones.
+    '''
+
+    def __init__(self, durations=False):
+        self.count = 0
+        self.kept = []
+        self.durations = [] if durations else None
+
+    def append(self, report, keep=False):
+        self.count += 1
+        if keep:
+            self.kept.append(report)
+        elif self.durations is not None:
+            self.durations.append(DurationRecord(report.nodeid, report.when, report.duration))
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return itertools.chain(self.kept, self.durations or [])
+
+
+class DurationRecord(object):
+    __slots__ = ('nodeid', 'when', 'duration')
+
+    def __init__(self, nodeid, when, duration):
+        self.nodeid = nodeid
+        self.when = when
+        self.duration = duration
+
+
 class ConcurrentTerminalReporter(TerminalReporter):
     '''to provide terminal reporting for multiprocess mode'''
 
-    def __init__(self, reporter):
+    def __init__(self, reporter, compact_stats=False):
         TerminalReporter.__init__(self, reporter.config)
         self._tw = reporter._tw
-        self.stats = STATS
+        self.compact_stats = compact_stats
+        self.failed_calls = set()  # nodeids whose teardown report is printed with their failure
 
     def add_stats(self, key):
         if key in self.stats:
             self.stats[key] += 1
 
+    def _add_compact(self, cat, report):
+        if cat == 'passed':
+            # -rP prints the captured output of passed tests
+            keep = self.hasopt('P')
+        else:
+            keep = report.when == 'teardown' and report.nodeid in self.failed_calls
+            if report.when == 'teardown':
+                self.failed_calls.discard(report.nodeid)
+        if cat not in self.stats:
+            self.stats[cat] = CompactReports(self.config.option.durations is not None)
+        self.stats[cat].append(report, keep)
+
     def pytest_runtest_logreport(self, report):
         rep = report
         res = self.config.hook.pytest_report_teststatus(report=rep)
         cat, letter, word = res
 
-        append_list(self.stats, cat, rep)
-
-        if report.when == 'call':
-            DICTIONARY[report.nodeid] = report
+        if self.compact_stats and rep.failed and rep.when == 'call':
+            self.failed_calls.add(rep.nodeid)
+        if self.compact_stats and cat in ['passed', '']:
+            self._add_compact(cat, rep)
+        else:
+            self.stats.setdefault(cat, []).append(rep)
         self._tests_ran = True
         if not letter and not word:
             # probably passed setup/teardown
@@ -358,19 +2940,3 @@ class ConcurrentTerminalReporter(TerminalReporter):
                 self._tw.write(word, **markup)
                 self._tw.write(" " + line)
                 self.currentfspath = -2
-
-
-def append_list(stats, cat, rep):
-    LOCK.acquire()
-    cat_string = str(cat)
-    if stats.get(cat_string) is None:
-        stats[cat_string] = MANAGER.list()
-
-    mylist = stats.get(cat_string)
-    mylist.append(rep)
-    stats[cat] = mylist
-    LOCK.release()
-
-
-def concurrent_log_to_xml(log):
-    return py.xml.raw(log)
@@ -0,0 +1,116 @@
+import sys
+import time
+import pytest
+
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 5), reason="needs async def")
+
+
+def test_coroutines_on_one_loop(testdir):
+    """Make sure that coroutine tests run concurrently on one event loop."""
+
+    testdir.makepyfile("""
+        import asyncio
+        import threading
+        import time
+        import pytest
+
+        loops = set()
+
+        @pytest.mark.parametrize('name', ['this', 'is', 'a', 'book'])
+        async def test_coroutine(name):
+            loops.add(id(asyncio.get_event_loop()))
+            await asyncio.sleep(2)
+            assert len(loops) == 1
+
+        async def test_coroutine_failure():
+            await asyncio.sleep(1)
+            assert 1 == 2
+
+        def test_sync():
+            assert threading.current_thread() is not threading.main_thread()
+            time.sleep(1)
+    """)
+
+    before_run = time.time()
+    result = testdir.runpytest('--concmode=asyncio', '--concworkers=6')
+    after_run = time.time()
+
+    result.stdout.fnmatch_lines([
+        '*.py:*: AssertionError',
+        '*1 failed, 5 passed*',
+    ])
+
+    time_diff = after_run - before_run
+    assert time_diff > 2 and time_diff < 4
+
+
+def test_coroutines_do_not_hold_threads(testdir):
+    """Make sure that awaited coroutine tests do not keep a thread busy each."""
+
+    testdir.makepyfile("""
+        import asyncio
+        import threading
+        import pytest
+
+        @pytest.fixture
+        def value():
+            yield 42
+
+        @pytest.mark.parametrize('para', range(60))
+        async def test_coroutine(para, value):
+            await asyncio.sleep(1)
+            with open('threads.txt', 'a') as threads:
+                threads.write('%d\\n' % threading.active_count())
+            assert value == 42
+    """)
+
+    before_run = time.time()
+    result = testdir.runpytest('--concmode=asyncio', '--concworkers=60', '--durations=1')
+    after_run = time.time()
+
+    result.stdout.fnmatch_lines([
+        '1.0*s call *test_coroutine*',
+        '*60 passed*',
+    ])
+    assert after_run - before_run < 3
+    # the thread pool only runs the setup and teardown of the coroutine tests
+    assert max(int(count) for count in testdir.tmpdir.join('threads.txt').read().split()) < 40
+
+
+def test_protocol_hook_wrappers(testdir):
+    """Make sure that filterwarnings applies to coroutine tests, which are only awaited without it."""
+
+    testdir.makeconftest("""
+        import pytest
+
+        @pytest.hookimpl(hookwrapper=True)
+        def pytest_runtest_protocol(item):
+            with open('wrapped.txt', 'a') as wrapped:
+                wrapped.write(item.name + '\\n')
+            yield
+    """)
+    testdir.makepyfile("""
+        import asyncio
+        import warnings
+        import pytest
+
+        @pytest.mark.filterwarnings('error')
+        async def test_warns():
+            await asyncio.sleep(0)
+            warnings.warn(UserWarning('turned into an error'))
+
+        async def test_awaited():
+            await asyncio.sleep(0)
+
+        def test_sync():
+            pass
+    """)
+
+    result = testdir.runpytest('--concmode=asyncio')
+
+    result.stdout.fnmatch_lines([
+        '*UserWarning: turned into an error*',
+        '*1 failed, 2 passed*'
+    ])
+    # awaited coroutines do not go through the pytest_runtest_protocol wrappers
+    assert sorted(testdir.tmpdir.join('wrapped.txt').read().split()) == ['test_sync', 'test_warns']
@@ -0,0 +1,65 @@
+import sys
+import pytest
+
+
+@pytest.mark.skipif(sys.platform == 'win32',
+                    reason="does not run on windows")
+@pytest.mark.parametrize('mode', ['mthread', 'mproc'])
+def test_auto_workers_within_bounds(testdir, mode):
+    """Make sure that --concworkers=auto keeps the running items within its bounds."""
+
+    testdir.makepyfile("""
+        import os
+        import time
+        import threading
+        import pytest
+
+        @pytest.mark.parametrize('para', range(8))
+        def test_sleep(para):
+            with open('running.txt', 'a') as running:
+                running.write('%d-%d start %f\\n' % (os.getpid(), threading.current_thread().ident, time.time()))
+            time.sleep(0.3)
+            with open('running.txt', 'a') as running:
+                running.write('%d-%d stop %f\\n' % (os.getpid(), threading.current_thread().ident, time.time()))
+    """)
+
+    result = testdir.runpytest_subprocess('--concmode=%s' % mode, '--concworkers=auto:2-2')
+
+    result.stdout.fnmatch_lines([
+        '*8 passed*'
+    ])
+    events = sorted((float(line.split()[2]), line.split()[1]) for line in testdir.tmpdir.join('running.txt').readlines())
+    running = peak = 0
+    for _, event in events:
+        running += 1 if event == 'start' else -1
+        peak = max(peak, running)
+    assert peak == 2
+
+
+def test_auto_workers_scaling_decisions(testdir, monkeypatch):
+    """Make sure that the admission control grows while there is room, shrinks under pressure and logs it."""
+
+    import psutil
+    import pytest_concurrent
+
+    config = testdir.parseconfigure('--concmode=mthread')
+    auto = pytest_concurrent.AutoWorkers(config, 1, 3)
+    lines = []
+    monkeypatch.setattr(config.pluginmanager.getplugin('terminalreporter'), 'write_line', lines.append)
+    monkeypatch.setattr(pytest_concurrent, 'AUTO_INTERVAL', 0)
+    monkeypatch.setattr(pytest_concurrent.os, 'getloadavg', lambda: (0.0, 0.0, 0.0))
+    memory = psutil.virtual_memory()
+    auto.limit = 1
+
+    assert auto.update(running=1, item_rss=0) == 2
+    assert auto.update(running=1, item_rss=0) == 2
+    assert auto.update(running=2, item_rss=0) == 3
+    assert auto.update(running=3, item_rss=0) == 3
+
+    monkeypatch.setattr(auto.psutil, 'virtual_memory', lambda: memory._replace(available=0))
+    assert auto.update(running=3, item_rss=0) == 2
+    assert len(lines) == 3
+    assert lines[-1].startswith('concurrent workers: 3 -> 2 (available memory 0MiB')
+
+    with pytest.raises(ValueError):
+        pytest_concurrent._parse_auto_workers(config, 'hybrid', 'auto')
@@ -0,0 +1,57 @@
+import pytest
+
+
+TESTS = """
+    import pytest
+
+    @pytest.fixture
+    def noisy():
+        yield
+        print('teardown output')
+
+    @pytest.mark.parametrize('para', range(20))
+    def test_pass(para):
+        print('x' * 10000)
+
+    def test_fail(noisy):
+        assert 1 == 2
+
+    @pytest.mark.xfail
+    def test_xfail():
+        assert 1 == 2
+"""
+
+
+@pytest.mark.parametrize('mode', ['mthread', 'mproc'])
+def test_compact_stats_keep_the_summary(testdir, mode):
+    """Make sure that --conccompactstats prints the same summary."""
+
+    testdir.makepyfile(TESTS)
+
+    results = [testdir.runpytest('--concmode=%s' % mode, '--concworkers=1', '-rx', '--durations=3', *args)
+               for args in [[], ['--conccompactstats']]]
+
+    for result in results:
+        result.stdout.fnmatch_lines([
+            '*FAILURES*',
+            '*assert 1 == 2*',
+            '*Captured stdout teardown*',
+            'teardown output',
+            'XFAIL*test_xfail',
+            '*slowest 3 test durations*',
+            '*1 failed, 20 passed, 1 xfailed*'
+        ])
+
+
+def test_compact_stats_only_count_passes(testdir):
+    """Make sure that --conccompactstats does not keep the passed reports."""
+
+    testdir.makepyfile(TESTS)
+
+    reprec = testdir.inline_run('--concmode=mthread', '--conccompactstats')
+    stats = reprec.getcall('pytest_terminal_summary').terminalreporter.stats
+
+    assert len(stats['passed']) == 20
+    assert list(stats['passed']) == []
+    assert [report.when for report in stats['']] == ['teardown']
+    assert len(stats['failed']) == 1 and len(stats['xfailed']) == 1
@@ -0,0 +1,96 @@
+import sys
+import time
+import pytest
+
+
+@pytest.mark.skipif(sys.platform == 'win32',
+                    reason="does not run on windows")
+@pytest.mark.parametrize('mode', ['mthread', 'mproc', 'hybrid',
+                                  pytest.param('asyncio', marks=pytest.mark.skipif(sys.version_info < (3, 5),
+                                                                                   reason="needs async def"))])
+def test_exitfirst_stops_dispatching(testdir, mode):
+    """Make sure that -x stops the run instead of executing every remaining item."""
+
+    testdir.makepyfile("""
+        import time
+        import pytest
+
+        def test_broken():
+            assert 1 == 2
+
+        @pytest.mark.parametrize('para', range(20))
+        def test_slow(para):
+            with open('started.txt', 'a') as started:
+                started.write('%d\\n' % para)
+            time.sleep(0.5)
+    """)
+
+    workers = '1x2' if mode == 'hybrid' else '2'
+    before_run = time.time()
+    result = testdir.runpytest('--concmode=%s' % mode, '--concworkers=%s' % workers, '-x')
+    after_run = time.time()
+
+    result.stdout.fnmatch_lines([
+        '*1 failed*'
+    ])
+    assert result.ret == 1
+    assert len(testdir.tmpdir.join('started.txt').read().split()) <= 4
+    assert after_run - before_run < 3
+
+
+@pytest.mark.skipif(sys.platform == 'win32',
+                    reason="does not run on windows")
+def test_maxfail_terminates_workers(testdir):
+    """Make sure that --concterminate does not wait for in-flight mproc items."""
+
+    testdir.makepyfile("""
+        import time
+        import pytest
+
+        @pytest.mark.parametrize('para', range(2))
+        def test_broken(para):
+            time.sleep(0.5)
+            assert 1 == 2
+
+        def test_hanging():
+            time.sleep(30)
+    """)
+
+    before_run = time.time()
+    result = testdir.runpytest('--concmode=mproc', '--concworkers=3', '--maxfail=2', '--concterminate')
+    after_run = time.time()
+
+    result.stdout.fnmatch_lines([
+        '*2 failed*'
+    ])
+    assert after_run - before_run < 10
+
+
+@pytest.mark.skipif(sys.platform == 'win32',
+                    reason="does not run on windows")
+@pytest.mark.parametrize('mode', ['mproc', 'hybrid'])
+def test_failures_reach_the_parent_right_away(testdir, mode):
+    """Make sure that a worker does not keep a failure buffered until its next item finishes."""
+
+    testdir.makepyfile("""
+        import time
+        import pytest
+
+        def test_broken():
+            assert 1 == 2
+
+        @pytest.mark.parametrize('para', range(4))
+        def test_slow(para):
+            time.sleep(2)
+    """)
+
+    workers = '1x2' if mode == 'hybrid' else '2'
+    before_run = time.time()
+    result = testdir.runpytest('--concmode=%s' % mode, '--concworkers=%s' % workers, '-x')
+    after_run = time.time()
+
+    result.stdout.fnmatch_lines([
+        '*1 failed*'
+    ])
+    # the items already running finish, nothing after them starts
+    assert after_run - before_run < 3.5
@@ -0,0 +1,63 @@
+import sys
+import pytest
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason="does not run on windows")
+
+
+def test_session_fixture_is_shared(testdir):
+    """Make sure that session fixtures are set up and torn down once, before forking the workers."""
+
+    testdir.makepyfile("""
+        import os
+        import pytest
+
+        @pytest.fixture(scope='session')
+        def dataset():
+            with open('setups.txt', 'a') as setups:
+                setups.write('%d\\n' % os.getpid())
+            yield {'pid': os.getpid(), 'rows': list(range(100000))}
+            with open('teardowns.txt', 'a') as teardowns:
+                teardowns.write('%d\\n' % os.getpid())
+
+        @pytest.mark.parametrize('para', range(6))
+        def test_rows(dataset, para):
+            assert dataset['pid'] != os.getpid()
+            assert len(dataset['rows']) == 100000
+    """)
+
+    result = testdir.runpytest('--concmode=mproc', '--concworkers=2', '--concforksession')
+    result.stdout.fnmatch_lines([
+        '*concurrent workers*',
+        'session fixtures set up before forking in *s: dataset',
+        'RSS per worker on average: *MiB shared, *MiB private',
+        '*6 passed*',
+    ])
+    setups = testdir.tmpdir.join('setups.txt').read().split()
+    assert setups == testdir.tmpdir.join('teardowns.txt').read().split()
+    assert len(setups) == 1
+
+
+def test_fork_unsafe_fixture(testdir):
+    """Make sure that a session fixture which starts a thread fails the session."""
+
+    testdir.makepyfile("""
+        import threading
+        import pytest
+
+        @pytest.fixture(scope='session')
+        def server():
+            stop = threading.Event()
+            thread = threading.Thread(target=stop.wait, name='fixture-server')
+            thread.start()
+            yield
+            stop.set()
+            thread.join()
+
+        def test_server(server):
+            pass
+    """)
+
+    result = testdir.runpytest('--concmode=mproc', '--concforksession')
+    result.stdout.fnmatch_lines([
+        '*RuntimeError: Session fixture server cannot be shared with forked workers, it left threads fixture-server behind*',
+    ])
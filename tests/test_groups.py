@@ -54,3 +54,87 @@ def test_concurrent_group(testdir, mode):
 
     time_diff = after_run - before_run
     assert time_diff > 5 and time_diff < 8  # expected: 6
+
+
+@pytest.mark.skipif(sys.platform == 'win32',
+                    reason="does not run on windows")
+@pytest.mark.parametrize('mode', ['mthread', 'mproc'])
+def test_named_group_dependencies(testdir, mode):
+    """Make sure that named groups wait for their dependencies only."""
+
+    testdir.makepyfile("""
+        import pytest
+        import time
+
+        def log(event):
+            with open('events.txt', 'a') as events:
+                events.write(event + '\\n')
+
+        @pytest.mark.concgroup('db')
+        def test_db():
+            log('db-start')
+            time.sleep(1)
+            log('db-end')
+
+        @pytest.mark.concgroup('api', after='db')
+        @pytest.mark.parametrize('para', [1, 2])
+        def test_api(para):
+            log('api')
+
+        @pytest.mark.concgroup('ui')
+        def test_ui():
+            time.sleep(0.2)
+            log('ui')
+    """)
+
+    result = testdir.runpytest('--concmode=%s' % mode, '--concworkers=4')
+    result.stdout.fnmatch_lines([
+        '*4 passed*'
+    ])
+
+    events = testdir.tmpdir.join('events.txt').read().split()
+    assert events.index('db-end') < events.index('api')
+    assert events.index('ui') < events.index('db-end')
+
+
+def test_circular_group_dependencies(testdir):
+    """Make sure that circular group dependencies are refused."""
+
+    testdir.makepyfile("""
+        import pytest
+
+        @pytest.mark.concgroup('db', after='api')
+        def test_db():
+            pass
+
+        @pytest.mark.concgroup('api', after='db')
+        def test_api():
+            pass
+    """)
+
+    result = testdir.runpytest('--concmode=mthread')
+    result.stdout.fnmatch_lines([
+        '*ValueError: Concurrent groups depend on each other*'
+    ])
+
+
+@pytest.mark.parametrize('mode', ['mthread', 'mproc'])
+def test_group_named_ungrouped(testdir, mode):
+    """Make sure that a group named ungrouped does not take the place of the items without a group."""
+
+    testdir.makepyfile("""
+        import pytest
+
+        @pytest.mark.concgroup('ungrouped')
+        @pytest.mark.parametrize('para', [1, 2])
+        def test_named(para):
+            pass
+
+        def test_without_group():
+            pass
+    """)
+
+    result = testdir.runpytest('--concmode=%s' % mode, '--concworkers=2')
+    result.stdout.fnmatch_lines([
+        '*3 passed*'
+    ])
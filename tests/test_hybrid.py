@@ -0,0 +1,58 @@
+import sys
+import pytest
+
+
+@pytest.mark.skipif(sys.platform == 'win32',
+                    reason="does not run on windows")
+def test_processes_times_threads(testdir):
+    """Make sure that hybrid mode runs threads in a few worker processes."""
+
+    testdir.makepyfile("""
+        import os
+        import threading
+        import time
+        import pytest
+
+        def log(event):
+            with open('events.txt', 'a') as events:
+                events.write('%s %d %s\\n' % (event, os.getpid(), threading.current_thread().name))
+
+        @pytest.mark.parametrize('para', range(8))
+        def test_io(para):
+            log('io')
+            time.sleep(0.5)
+
+        @pytest.mark.conctier('process')
+        def test_cpu():
+            log('cpu-start')
+            time.sleep(0.5)
+            log('cpu-end')
+    """)
+
+    result = testdir.runpytest('--concmode=hybrid', '--concworkers=2x4', '--junitxml=junit.xml')
+    result.stdout.fnmatch_lines([
+        '*9 passed*'
+    ])
+    assert 'tests="9"' in testdir.tmpdir.join('junit.xml').read()
+
+    events = [line.split(' ', 2) for line in testdir.tmpdir.join('events.txt').readlines()]
+    assert len(set(pid for _, pid, _ in events)) == 2
+    assert len(set((pid, thread) for _, pid, thread in events)) > 2
+
+    # nothing else runs in the process of the process tier test while it runs
+    start = [event[0] for event in events].index('cpu-start')
+    end = [event[0] for event in events].index('cpu-end')
+    cpu_pid = events[start][1]
+    assert not [event for event in events[start + 1:end] if event[1] == cpu_pid]
+
+
+def test_invalid_hybrid_workers(testdir):
+    testdir.makepyfile("""
+        def test_nothing():
+            pass
+    """)
+
+    result = testdir.runpytest('--concmode=hybrid', '--concworkers=2y4')
+    result.stdout.fnmatch_lines([
+        '*ValueError: Hybrid concurrent workers can only be PROCESSESxTHREADS integers*'
+    ])
@@ -0,0 +1,147 @@
+import sys
+import time
+import pytest
+
+
+@pytest.mark.skipif(sys.platform == 'win32',
+                    reason="does not run on windows")
+def test_worker_processes_are_reused(testdir):
+    """Make sure that mproc runs many items in a few long-lived processes."""
+
+    testdir.makepyfile("""
+        import os
+        import pytest
+
+        @pytest.mark.parametrize('para', range(8))
+        def test_pid(para):
+            with open('pids.txt', 'a') as pids:
+                pids.write('%d\\n' % os.getpid())
+    """)
+
+    testdir.runpytest('--concmode=mproc', '--concworkers=2')
+
+    pids = testdir.tmpdir.join('pids.txt').read().split()
+    assert len(pids) == 8
+    assert len(set(pids)) <= 2
+
+
+@pytest.mark.skipif(sys.platform == 'win32',
+                    reason="does not run on windows")
+def test_reports_are_merged_in_parent(testdir):
+    """Make sure that reports from every worker reach the terminal and the junit xml."""
+
+    testdir.makepyfile("""
+        import pytest
+
+        @pytest.mark.parametrize('para', range(100))
+        def test_many(para):
+            assert para % 10
+
+        @pytest.mark.xfail(reason='')
+        def test_xfail():
+            assert False
+    """)
+
+    result = testdir.runpytest('--concmode=mproc', '--concworkers=3', '--junitxml=junit.xml')
+
+    result.stdout.fnmatch_lines([
+        '*10 failed, 90 passed, 1 xfailed*'
+    ])
+    assert result.ret == 1
+
+    xml = testdir.tmpdir.join('junit.xml').read()
+    assert 'tests="101"' in xml
+    assert 'failures="10"' in xml
+    assert xml.count('<testcase ') == 101
+
+
+@pytest.mark.parametrize('mode', [None, 'mthread', 'mproc'])
+def test_worker_pool_only_for_mproc(testdir, mode):
+    """Make sure that the mproc state is only set up when mproc is selected."""
+
+    args = ['--concmode=%s' % mode] if mode else []
+    config = testdir.parseconfigure(*args)
+    pool = config.pluginmanager.getplugin('concurrentpool')
+
+    if mode == 'mproc':
+        assert pool is not None
+        assert pool.stopped is None and not pool.workers
+    else:
+        assert pool is None
+
+
+def test_junitxml_is_streamed(testdir):
+    """Make sure that finished testcases are in a well-formed JUnit XML file while the session runs."""
+
+    testdir.makepyfile("""
+        import xml.etree.ElementTree as ElementTree
+        import pytest
+
+        @pytest.mark.concgroup(1)
+        def test_first():
+            pass
+
+        @pytest.mark.concgroup(2)
+        def test_second():
+            suite = ElementTree.parse('junit.xml').getroot()
+            assert [case.get('name') for case in suite] == ['test_first']
+    """)
+
+    result = testdir.runpytest('--concmode=mproc', '--junitxml=junit.xml')
+
+    result.stdout.fnmatch_lines([
+        '*2 passed*'
+    ])
+    xml = testdir.tmpdir.join('junit.xml').read()
+    assert 'tests="2"' in xml
+    assert xml.count('<testcase ') == 2
+
+
+@pytest.mark.skipif(sys.platform == 'win32',
+                    reason="does not run on windows")
+def test_tiny_items_do_not_wait_for_lookahead(testdir):
+    """Make sure that a worker sends its reports before waiting for the next batch."""
+
+    testdir.makepyfile("""
+        import pytest
+
+        @pytest.mark.parametrize('para', range(200))
+        def test_tiny(para):
+            pass
+    """)
+
+    before_run = time.time()
+    result = testdir.runpytest('--concmode=mproc', '--concworkers=2')
+    after_run = time.time()
+
+    result.stdout.fnmatch_lines([
+        '*200 passed*'
+    ])
+    # every batch waited LOOKAHEAD_TIMEOUT for the parent when the reports were still buffered
+    assert after_run - before_run < 2.5
+
+
+@pytest.mark.skipif(sys.platform == 'win32',
+                    reason="does not run on windows")
+@pytest.mark.parametrize('mode', ['mproc', 'hybrid'])
+def test_protocol_hook_wrappers_run_in_workers(testdir, mode):
+    """Make sure that the pytest_runtest_protocol wrappers of other plugins (filterwarnings) wrap items in workers."""
+
+    testdir.makepyfile("""
+        import warnings
+        import pytest
+
+        @pytest.mark.filterwarnings('error')
+        def test_warns():
+            warnings.warn(UserWarning('turned into an error'))
+
+        def test_other():
+            pass
+    """)
+
+    result = testdir.runpytest('--concmode=%s' % mode)
+
+    result.stdout.fnmatch_lines([
+        '*UserWarning: turned into an error*',
+        '*1 failed, 1 passed*'
+    ])
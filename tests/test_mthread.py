@@ -1,4 +1,7 @@
 import time
+import concurrent.futures
+
+from pytest_concurrent import _worker_count
 
 
 def test_multithread(testdir):
@@ -36,3 +39,40 @@ def test_multithread(testdir):
 
     time_diff = after_run - before_run
     assert time_diff > 4 and time_diff < 6
+
+
+def test_batch_errors_are_raised(testdir):
+    """Make sure that an error escaping the test protocol of a thread is not dropped."""
+
+    testdir.makeconftest("""
+        import pytest
+
+        @pytest.hookimpl(hookwrapper=True)
+        def pytest_runtest_protocol(item):
+            if item.name == 'test_broken':
+                raise RuntimeError('the protocol broke')
+            yield
+    """)
+    testdir.makepyfile("""
+        def test_broken():
+            pass
+
+        def test_other():
+            pass
+    """)
+
+    result = testdir.runpytest('--concmode=mthread')
+
+    result.stdout.fnmatch_lines([
+        '*RuntimeError: the protocol broke*'
+    ])
+    assert result.ret == 3
+
+
+def test_default_thread_count():
+    """Make sure that mthread keeps the default amount of threads of ThreadPoolExecutor on this python."""
+
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        threads = executor._max_workers
+    assert _worker_count('mthread', None, 1000) == min(threads, 1000)
+    assert _worker_count('mthread', None, 2) == 2
@@ -0,0 +1,44 @@
+import sys
+import pytest
+
+
+@pytest.mark.skipif(sys.platform == 'win32',
+                    reason="does not run on windows")
+@pytest.mark.parametrize('limit', ['--concmaxtests-per-worker=2', '--concmaxrss-per-worker=150'])
+def test_workers_are_recycled(testdir, limit):
+    """Make sure that a worker process going over its limit is replaced by a fresh one."""
+
+    testdir.makepyfile("""
+        import os
+        import pytest
+
+        LEAK = []
+
+        def log(event):
+            with open('events.txt', 'a') as events:
+                events.write(event + '\\n')
+
+        @pytest.fixture(scope='module')
+        def resource():
+            log('setup')
+            yield
+            log('teardown')
+
+        @pytest.mark.parametrize('para', range(4))
+        def test_leaky(resource, para):
+            LEAK.append(b'x' * (100 * 1024 * 1024))
+            with open('pids.txt', 'a') as pids:
+                pids.write('%d\\n' % os.getpid())
+    """)
+
+    result = testdir.runpytest_subprocess('--concmode=mproc', '--concworkers=1', limit)
+
+    result.stdout.fnmatch_lines([
+        '*concurrent workers*',
+        'worker *: 2 tests, peak RSS *MiB (recycled)',
+        '*4 passed*'
+    ])
+    assert len(set(testdir.tmpdir.join('pids.txt').read().split())) == 2
+    # a recycled worker tears down its fixtures before it exits
+    events = testdir.tmpdir.join('events.txt').read().split()
+    assert events.count('setup') == events.count('teardown') == 2
@@ -0,0 +1,137 @@
+import sys
+import time
+import socket
+import subprocess
+import pytest
+
+
+def _free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def _wait(worker, timeout=30):
+    # Popen.wait has no timeout on python 2
+    deadline = time.time() + timeout
+    while worker.poll() is None and time.time() < deadline:
+        time.sleep(0.1)
+    return worker.poll()
+
+
+def _start_worker(testdir, address, *args):
+    return subprocess.Popen([sys.executable, '-m', 'pytest', '--concworker-connect=%s' % address] + list(args),
+                            cwd=str(testdir.tmpdir), stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+
+@pytest.mark.skipif(sys.platform == 'win32',
+                    reason="does not run on windows")
+def test_remote_workers_over_loopback(testdir):
+    """Make sure that a remote mode session hands its tests to the workers which connect to it."""
+
+    testdir.makepyfile("""
+        import os
+        import time
+        import pytest
+
+        @pytest.mark.parametrize('para', range(10))
+        def test_remote(para):
+            with open('pids.txt', 'a') as pids:
+                pids.write('%d\\n' % os.getpid())
+            time.sleep(0.1)
+
+        def test_broken():
+            assert 1 == 2
+    """)
+    address = '127.0.0.1:%d' % _free_port()
+    workers = [_start_worker(testdir, address) for _ in range(2)]
+
+    result = testdir.runpytest_subprocess('--concmode=remote', '--concserve=%s' % address, '--junitxml=junit.xml')
+
+    for worker in workers:
+        assert _wait(worker) == 0
+    result.stdout.fnmatch_lines([
+        'concurrent workers connect to: %s' % address,
+        '*assert 1 == 2*',
+        '*concurrent workers*',
+        'worker 127.0.0.1:*: * tests (done)',
+        'worker 127.0.0.1:*: * tests (done)',
+        '*1 failed, 10 passed*'
+    ])
+    assert len(set(testdir.tmpdir.join('pids.txt').read().split())) == 2
+    xml = testdir.tmpdir.join('junit.xml').read()
+    assert 'tests="11"' in xml and 'failures="1"' in xml
+
+
+@pytest.mark.skipif(sys.platform == 'win32',
+                    reason="does not run on windows")
+def test_remote_worker_with_other_tests_is_refused(testdir):
+    """Make sure that a worker which did not collect the tests of the session does not join it."""
+
+    testdir.makepyfile(test_first="def test_first(): pass")
+    testdir.makepyfile(test_second="def test_second(): pass")
+    address = '127.0.0.1:%d' % _free_port()
+    refused = _start_worker(testdir, address, 'test_second.py')
+    accepted = _start_worker(testdir, address, 'test_first.py', 'test_second.py')
+
+    result = testdir.runpytest_subprocess('--concmode=remote', '--concserve=%s' % address)
+
+    result.stdout.fnmatch_lines([
+        '*2 passed*'
+    ])
+    assert _wait(accepted) == 0
+    assert _wait(refused) == 2
+    assert b'tests of the session were not collected by this worker' in refused.stdout.read()
+
+
+@pytest.mark.skipif(sys.platform == 'win32',
+                    reason="does not run on windows")
+def test_session_key_is_private(testdir):
+    """Make sure that a loopback session without PYTEST_CONCURRENT_AUTHKEY only lets its user's workers in."""
+
+    testdir.makepyfile("""
+        import multiprocessing.connection
+        import os
+        import stat
+        import pytest
+
+        def test_key():
+            path, = [os.path.join(directory, name) for directory, _, names in os.walk('.pytest_cache')
+                     for name in names if name.startswith('authkey-')]
+            assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+            port = int(path.rpartition('-')[2])
+            with pytest.raises(multiprocessing.AuthenticationError):
+                multiprocessing.connection.Client(('127.0.0.1', port), authkey=b'pytest-concurrent')
+    """)
+    address = '127.0.0.1:%d' % _free_port()
+    worker = _start_worker(testdir, address)
+
+    result = testdir.runpytest_subprocess('--concmode=remote', '--concserve=%s' % address)
+
+    assert _wait(worker) == 0
+    result.stdout.fnmatch_lines([
+        '*1 passed*'
+    ])
+    assert not list(testdir.tmpdir.join('.pytest_cache').visit('authkey-*'))
+
+
+def test_session_without_workers_stops(testdir):
+    """Make sure that a remote mode session does not wait forever for its first worker."""
+
+    testdir.makepyfile("""
+        def test_pass():
+            pass
+    """)
+    testdir.makeini("""
+        [pytest]
+        concurrent_connect_timeout = 1
+    """)
+
+    result = testdir.runpytest_subprocess('--concmode=remote')
+
+    result.stdout.fnmatch_lines([
+        '*No concurrent worker connected to 127.0.0.1:* within 1.0s*'
+    ])
+    assert result.ret == 2
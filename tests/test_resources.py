@@ -0,0 +1,51 @@
+import sys
+import pytest
+
+
+@pytest.mark.skipif(sys.platform == 'win32',
+                    reason="does not run on windows")
+@pytest.mark.parametrize('mode', ['mthread', 'mproc'])
+@pytest.mark.parametrize('capacity', [1, 2])
+def test_resource_capacity(testdir, mode, capacity):
+    """Make sure that no more tests than the capacity hold a resource at once."""
+
+    testdir.makeini("""
+        [pytest]
+        concurrent_resources = db=%d
+    """ % capacity)
+
+    testdir.makepyfile("""
+        import os
+        import time
+        import pytest
+
+        def log(event):
+            with open('events.txt', 'a') as events:
+                events.write(event + '\\n')
+
+        @pytest.mark.concresource('db')
+        @pytest.mark.parametrize('para', range(4))
+        def test_db(para):
+            log('start')
+            time.sleep(0.3)
+            log('end')
+
+        @pytest.mark.parametrize('para', range(2))
+        def test_free(para):
+            log('free')
+    """)
+
+    result = testdir.runpytest('--concmode=%s' % mode, '--concworkers=4')
+    result.stdout.fnmatch_lines([
+        '*6 passed*'
+    ])
+
+    holders = 0
+    most = 0
+    events = testdir.tmpdir.join('events.txt').read().split()
+    for event in events:
+        holders += {'start': 1, 'end': -1}.get(event, 0)
+        most = max(most, holders)
+    assert most == capacity
+    # free tests are not stuck behind the resource
+    assert events.index('free') < events.index('end')
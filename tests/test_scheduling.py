@@ -0,0 +1,140 @@
+import sys
+import pytest
+
+
+@pytest.mark.parametrize('mode', ['mthread', 'mproc'])
+def test_duration_order(testdir, mode):
+    """Make sure that items are dispatched longest first once durations are known."""
+
+    testdir.makepyfile("""
+        import time
+        import pytest
+
+        @pytest.mark.parametrize('delay', [0.1, 0.3, 0.2])
+        def test_sleep(delay):
+            with open('order.txt', 'a') as order:
+                order.write('%s\\n' % delay)
+            time.sleep(delay)
+    """)
+
+    args = ['--concmode=%s' % mode, '--concworkers=1', '--concorder=duration', '--concmakespan']
+    result = testdir.runpytest(*args)
+    result.stdout.fnmatch_lines([
+        '*concurrent makespan*',
+        'group ungrouped: predicted 0.00s, actual *',
+    ])
+    assert testdir.tmpdir.join('order.txt').read().split() == ['0.1', '0.3', '0.2']
+
+    testdir.tmpdir.join('order.txt').remove()
+    result = testdir.runpytest(*args)
+    result.stdout.fnmatch_lines([
+        'group ungrouped: predicted 0.6*s, actual *',
+    ])
+    assert testdir.tmpdir.join('order.txt').read().split() == ['0.3', '0.2', '0.1']
+
+
+@pytest.mark.skipif(sys.platform == 'win32',
+                    reason="does not run on windows")
+def test_fixture_batching(testdir):
+    """Make sure that a module scoped fixture is set up once for a batch."""
+
+    testdir.makepyfile("""
+        import pytest
+
+        @pytest.fixture(scope='module')
+        def schema():
+            with open('setups.txt', 'a') as setups:
+                setups.write('setup\\n')
+
+        @pytest.mark.parametrize('para', range(6))
+        def test_query(schema, para):
+            pass
+
+        @pytest.mark.parametrize('para', range(4))
+        def test_standalone(para):
+            pass
+    """)
+
+    result = testdir.runpytest('--concmode=mproc', '--concworkers=3', '--concbatch')
+    result.stdout.fnmatch_lines([
+        '*concurrent fixture batching*',
+        '1 module/class fixture setups for 6 uses, 5 saved',
+    ])
+    assert testdir.tmpdir.join('setups.txt').read().split() == ['setup']
+
+
+@pytest.mark.parametrize('mode', ['mthread', 'mproc'])
+def test_failure_first_order(testdir, mode):
+    """Make sure that items which failed before are dispatched first."""
+
+    testdir.makepyfile("""
+        import os
+        import pytest
+
+        @pytest.mark.parametrize('name', ['first', 'second', 'broken', 'flaky', 'last'])
+        def test_name(name):
+            with open('order.txt', 'a') as order:
+                order.write('%s\\n' % name)
+            assert name != 'broken'
+            if name == 'flaky':
+                assert os.path.exists('flaky.txt')
+    """)
+
+    args = ['--concmode=%s' % mode, '--concworkers=1', '--concorder=failures']
+    result = testdir.runpytest(*args)
+    result.stdout.fnmatch_lines([
+        '*concurrent first failure*',
+        'first failure after *s: test_failure_first_order.py::test_name?broken?',
+    ])
+    assert testdir.tmpdir.join('order.txt').read().split() == ['first', 'second', 'broken', 'flaky', 'last']
+
+    # flaky passes from now on, it keeps its failure score but leaves lastfailed
+    testdir.tmpdir.join('flaky.txt').write('')
+    testdir.tmpdir.join('order.txt').remove()
+    testdir.runpytest(*args)
+    order = testdir.tmpdir.join('order.txt').read().split()
+    assert sorted(order[:2]) == ['broken', 'flaky']
+    assert order[2:] == ['first', 'second', 'last']
+
+    testdir.tmpdir.join('order.txt').remove()
+    testdir.runpytest(*args)
+    assert testdir.tmpdir.join('order.txt').read().split() == ['broken', 'flaky', 'first', 'second', 'last']
+
+
+@pytest.mark.parametrize('mode', ['mproc', 'hybrid'])
+def test_first_failure_time_in_workers(testdir, mode):
+    """Make sure that the time to the first failure is not delayed by the buffered reports of a worker."""
+
+    testdir.makepyfile("""
+        import time
+        import pytest
+
+        def test_broken():
+            assert 1 == 2
+
+        @pytest.mark.parametrize('para', range(2))
+        def test_slow(para):
+            time.sleep(2)
+    """)
+
+    workers = '1x2' if mode == 'hybrid' else '2'
+    result = testdir.runpytest('--concmode=%s' % mode, '--concworkers=%s' % workers)
+    result.stdout.fnmatch_lines([
+        '*concurrent first failure*',
+        'first failure after 0.*s: test_first_failure_time_in_workers.py::test_broken',
+    ])
+
+
+@pytest.mark.parametrize('mode, workers', [('mthread', '2'), ('asyncio', '2'), ('hybrid', '1x2')])
+def test_fixture_batching_needs_one_thread_per_process(testdir, mode, workers):
+    """Make sure that fixture batching is refused where threads share the fixture setup state."""
+
+    testdir.makepyfile("""
+        def test_pass():
+            pass
+    """)
+
+    result = testdir.runpytest('--concmode=%s' % mode, '--concworkers=%s' % workers, '--concbatch')
+    result.stdout.fnmatch_lines([
+        '*ValueError: Fixture batching is only supported with one thread per process*',
+    ])
@@ -0,0 +1,106 @@
+import json
+import pytest
+
+
+TESTS = """
+    import pytest
+
+    @pytest.mark.concgroup(1)
+    @pytest.mark.parametrize('para', range(4))
+    def test_first(para):
+        pass
+
+    @pytest.mark.parametrize('para', range(6))
+    def test_second(para):
+        pass
+"""
+
+
+def _write_durations(testdir, durations):
+    cache = testdir.tmpdir.join('.pytest_cache', 'v', 'concurrent', 'durations')
+    cache.write(json.dumps(durations), ensure=True)
+
+
+@pytest.mark.parametrize('mode', ['mthread', 'mproc'])
+def test_shards_are_balanced_by_duration(testdir, mode):
+    """Make sure that the shards split the items by their historical duration, not by their amount."""
+
+    testdir.makepyfile(TESTS)
+    durations = dict(('test_shards_are_balanced_by_duration.py::test_second[%d]' % para, 1.0) for para in range(6))
+    durations.update(('test_shards_are_balanced_by_duration.py::test_first[%d]' % para, 0.0) for para in range(4))
+    durations['test_shards_are_balanced_by_duration.py::test_first[0]'] = 6.0
+    _write_durations(testdir, durations)
+
+    result = testdir.runpytest('--concshardplan=2', '--concshardfile=plan.json')
+    result.stdout.fnmatch_lines([
+        '*concurrent shard plan*',
+        'shard 1/2: 4 tests, 6.*s',
+        '    test_shards_are_balanced_by_duration.py::test_first[0]',
+        'shard 2/2: 6 tests, 6.*s',
+        '    test_shards_are_balanced_by_duration.py::test_second[0]',
+        'plan written to plan.json',
+    ])
+
+    passed = []
+    for index in [1, 2]:
+        result = testdir.runpytest('--concmode=%s' % mode, '--concshard=%d/2' % index, '--concshardfile=plan.json',
+                                   '-v', '-p', 'no:cacheprovider')
+        passed.append(set(line.split()[0] for line in result.stdout.lines if 'PASSED' in line))
+    assert not passed[0] & passed[1]
+    assert len(passed[0] | passed[1]) == 10
+    assert len(passed[0]) == 4
+    assert 'test_shards_are_balanced_by_duration.py::test_first[0]' in passed[0]
+
+
+def test_shards_with_different_caches(testdir):
+    """Make sure that machines with different durations in their cache still run every item exactly once."""
+
+    testdir.makepyfile(TESTS)
+    passed = []
+    for index in [1, 2]:
+        # every machine has seen another slow test
+        durations = dict(('test_shards_with_different_caches.py::test_second[%d]' % para, 0.1) for para in range(6))
+        durations.update(('test_shards_with_different_caches.py::test_first[%d]' % para, 0.1) for para in range(4))
+        durations['test_shards_with_different_caches.py::test_second[%d]' % (index * 2)] = 10.0
+        _write_durations(testdir, durations)
+        result = testdir.runpytest('--concmode=mthread', '--concshard=%d/2' % index, '-v')
+        passed.append(set(line.split()[0] for line in result.stdout.lines if 'PASSED' in line))
+    assert not passed[0] & passed[1]
+    assert len(passed[0] | passed[1]) == 10
+
+
+def test_items_missing_from_shard_plan(testdir):
+    """Make sure that items added after the plan was written still run in exactly one shard."""
+
+    testdir.makepyfile(TESTS)
+    testdir.runpytest('--concshardplan=2', '--concshardfile=plan.json')
+    testdir.makepyfile(TESTS + """
+    @pytest.mark.parametrize('para', range(4))
+    def test_added(para):
+        pass
+    """)
+
+    passed = []
+    for index in [1, 2]:
+        result = testdir.runpytest('--concmode=mthread', '--concshard=%d/2' % index, '--concshardfile=plan.json', '-v')
+        passed.append(set(line.split()[0] for line in result.stdout.lines if 'PASSED' in line))
+    assert not passed[0] & passed[1]
+    assert len(passed[0] | passed[1]) == 14
+
+    result = testdir.runpytest('--concmode=mthread', '--concshard=1/3', '--concshardfile=plan.json')
+    result.stdout.fnmatch_lines([
+        '*ValueError: Concurrent shard plan plan.json has 2 shards, not 3.*'
+    ])
+
+
+def test_shards_keep_group_order(testdir):
+    """Make sure that a shard still runs its groups in order."""
+
+    testdir.makepyfile(TESTS)
+
+    result = testdir.runpytest('--concmode=mthread', '--concshard=2/2', '-v', '-p', 'no:cacheprovider')
+
+    names = [line.split()[0].split('::')[1].split('[')[0] for line in result.stdout.lines if 'PASSED' in line]
+    assert len(names) == 5
+    assert names == sorted(names)
+    result.stdout.fnmatch_lines(['*5 passed, 5 deselected*'])
@@ -0,0 +1,124 @@
+import sys
+import multiprocessing
+import pytest
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason="does not run on windows")
+
+
+def _start_methods():
+    # python 2 only forks
+    return multiprocessing.get_all_start_methods() if hasattr(multiprocessing, 'get_all_start_methods') else ['fork']
+
+
+@pytest.mark.parametrize('method', ['fork', 'forkserver', 'spawn'])
+def test_start_method(testdir, method):
+    """Make sure that workers started with every start method run the session."""
+
+    if method not in _start_methods():
+        pytest.skip('%s is not available' % method)
+
+    # not named after this module, which spawned workers could import instead
+    testdir.makepyfile(test_started="""
+        import pytest
+
+        @pytest.mark.parametrize('para', range(4))
+        def test_pass(para):
+            pass
+
+        def test_fail():
+            assert False
+    """)
+
+    # inline runs re-import multiprocessing modules, which breaks pickling for spawned workers
+    result = testdir.runpytest_subprocess('--concmode=mproc', '--concworkers=2', '--concstart=%s' % method)
+    result.stdout.fnmatch_lines([
+        '*concurrent workers*',
+        '2 workers started with %s in *s on average, *s at most' % method,
+        '*1 failed, 4 passed*',
+    ])
+
+
+@pytest.mark.skipif('forkserver' not in _start_methods(), reason="needs the forkserver start method")
+def test_forkserver_preload(testdir):
+    """Make sure that preloaded modules are imported once into the forkserver."""
+
+    testdir.makepyfile(heavy="""
+        import os
+        with open('imports.txt', 'a') as imports:
+            imports.write('%d\\n' % os.getpid())
+    """)
+    testdir.makepyfile(test_preloaded="""
+        import pytest
+        import heavy
+
+        @pytest.mark.parametrize('para', range(6))
+        def test_pass(para):
+            pass
+    """)
+    testdir.makeini("""
+        [pytest]
+        concurrent_preload = heavy
+    """)
+
+    # a fresh process, the forkserver of this one may already run
+    result = testdir.runpytest_subprocess('--concmode=mproc', '--concworkers=3', '--concstart=forkserver')
+    result.stdout.fnmatch_lines([
+        '3 workers started with forkserver in *',
+        '*6 passed*',
+    ])
+    # the session itself and the forkserver, but none of the workers
+    assert len(testdir.tmpdir.join('imports.txt').readlines()) == 2
+
+
+def test_unknown_start_method(testdir):
+    testdir.makepyfile("""
+        def test_nothing():
+            pass
+    """)
+
+    result = testdir.runpytest('--concmode=mproc', '--concstart=vfork')
+    result.stdout.fnmatch_lines([
+        '*NotImplementedError: Concurrent start method vfork is not supported*',
+    ])
+
+
+@pytest.mark.skipif('spawn' not in _start_methods(), reason="needs the spawn start method")
+def test_spawned_workers_with_compact_stats(testdir):
+    """Make sure that spawned workers, which run without the terminal plugin, take --conccompactstats."""
+
+    testdir.makepyfile(test_compact="""
+        import pytest
+
+        @pytest.mark.parametrize('para', range(4))
+        def test_pass(para):
+            pass
+    """)
+
+    result = testdir.runpytest_subprocess('--concmode=mproc', '--concworkers=2', '--concstart=spawn', '--conccompactstats')
+    result.stdout.fnmatch_lines([
+        '*4 passed*',
+    ])
+    assert result.ret == 0
+
+
+@pytest.mark.skipif(sys.version_info < (3, 8), reason="needs multiprocessing.parent_process")
+def test_lost_worker_exit_code(testdir):
+    """Make sure that a worker lost before it could run tests is reported with its exit code."""
+
+    testdir.makeconftest("""
+        import multiprocessing
+        import os
+
+        def pytest_collection_finish(session):
+            if multiprocessing.parent_process() is not None:
+                os._exit(3)
+    """)
+    testdir.makepyfile(test_lost="""
+        def test_pass():
+            pass
+    """)
+
+    result = testdir.runpytest_subprocess('--concmode=mproc', '--concworkers=1', '--concstart=spawn')
+    result.stdout.fnmatch_lines([
+        '*A concurrent worker exited unexpectedly (exit code 3) before it could run tests*',
+    ])
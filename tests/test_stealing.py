@@ -0,0 +1,57 @@
+import sys
+import pytest
+
+
+@pytest.mark.parametrize('mode', ['mthread', 'mproc'])
+def test_idle_worker_steals_tail(testdir, mode):
+    """Make sure that an idle worker steals the last batch of a busy one."""
+
+    if mode == 'mproc' and sys.platform == 'win32':
+        pytest.skip('does not run on windows')
+
+    testdir.makepyfile("""
+        import os
+        import time
+
+        def record(name):
+            with open('order.txt', 'a') as order:
+                order.write('%s\\n' % name)
+
+        def test_first():
+            record('first')
+            time.sleep(0.5)
+
+        def test_second():
+            record('second')
+
+        def test_third():
+            record('third')
+
+        def test_last():
+            record('last')
+    """)
+
+    result = testdir.runpytest('--concmode=%s' % mode, '--concworkers=2', '--concsteal')
+    result.stdout.fnmatch_lines([
+        '*concurrent work stealing*',
+        '* of 4 batches stolen from busier workers',
+        '*4 passed*',
+    ])
+    assert result.ret == 0
+    # the module is seeded to one worker, the other one starts with its tail
+    order = testdir.tmpdir.join('order.txt').read().split()
+    assert order.index('last') < order.index('second')
+
+
+def test_steal_unsupported_mode(testdir):
+    """Make sure that work stealing is refused where workers do not pull batches."""
+
+    testdir.makepyfile("""
+        def test_pass():
+            pass
+    """)
+
+    result = testdir.runpytest('--concmode=asyncnet', '--concsteal')
+    result.stdout.fnmatch_lines([
+        '*ValueError: Work stealing is only supported in mthread, mproc, hybrid and remote mode.*',
+    ])
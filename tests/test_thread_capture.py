@@ -0,0 +1,84 @@
+import pytest
+from _pytest.capture import CaptureManager
+
+from pytest_concurrent import ThreadCaptureManager
+
+# other pytest versions keep the stock capture manager
+pytestmark = pytest.mark.skipif(not ThreadCaptureManager.supports(CaptureManager('sys')),
+                                reason='per thread capture is not supported by this pytest version')
+
+
+def captured_sections(lines):
+    """The lines of every captured output section."""
+    sections = []
+    section = None
+    for line in lines:
+        if line.startswith('-') and 'Captured' in line:
+            section = []
+            sections.append(section)
+        elif line.startswith(('_', '=', '-')):
+            section = None
+        elif section is not None and line:
+            section.append(line)
+    return sections
+
+
+def test_output_goes_to_its_test(testdir):
+    """Make sure that concurrent tests only get the output they wrote."""
+
+    testdir.makepyfile("""
+        import sys
+        import time
+        import pytest
+
+        @pytest.mark.parametrize('name', ['alpha', 'beta', 'gamma', 'delta'])
+        def test_chatty(name):
+            for _ in range(10):
+                print(name)
+                sys.stderr.write('err-%s\\n' % name)
+                time.sleep(0.01)
+            assert False
+    """)
+
+    result = testdir.runpytest('--concmode=mthread', '--concworkers=4')
+    result.stdout.fnmatch_lines([
+        '*4 failed*',
+    ])
+    sections = captured_sections(result.stdout.lines)
+    assert len(sections) == 8
+    for lines in sections:
+        assert len(lines) == 10 and len(set(lines)) == 1, lines
+
+
+def test_large_output_is_spooled(testdir):
+    """Make sure that the middle of a large output is left out of the report."""
+
+    testdir.makepyfile("""
+        def test_flood():
+            for index in range(200000):
+                print('line %d' % index)
+            assert False
+    """)
+
+    result = testdir.runpytest('--concmode=mthread', '--concworkers=2')
+    result.stdout.fnmatch_lines([
+        '*Captured stdout call*',
+        'line 0',
+        '... * bytes of output left out ...',
+        'line 199999',
+        '*1 failed*',
+    ])
+
+
+@pytest.mark.parametrize('capture', ['-s', '--capture=sys'])
+def test_capture_methods(testdir, capture):
+    testdir.makepyfile("""
+        def test_print():
+            print('visible')
+    """)
+
+    result = testdir.runpytest('--concmode=mthread', capture, '-rP')
+    assert result.ret == 0
+    result.stdout.fnmatch_lines([
+        '*visible*',
+    ])
@@ -0,0 +1,168 @@
+import sys
+import time
+import pytest
+
+
+@pytest.mark.skipif(sys.platform == 'win32',
+                    reason="does not run on windows")
+@pytest.mark.parametrize('mode', ['mthread', 'mproc', 'hybrid'])
+def test_hanging_test_times_out(testdir, mode):
+    """Make sure that a hanging test is reported as an error and does not hold its worker."""
+
+    testdir.makepyfile("""
+        import time
+        import pytest
+
+        @pytest.mark.conctimeout(1)
+        def test_hanging():
+            time.sleep(60)
+
+        @pytest.mark.parametrize('para', range(4))
+        def test_quick(para):
+            time.sleep(0.1)
+    """)
+
+    workers = '1x1' if mode == 'hybrid' else '1'
+    before_run = time.time()
+    result = testdir.runpytest_subprocess('--concmode=%s' % mode, '--concworkers=%s' % workers,
+                                          '--junitxml=junit.xml')
+    after_run = time.time()
+
+    result.stdout.fnmatch_lines([
+        '*Timeout: the test ran longer than 1.0s*',
+        '*4 passed, 1 error*'
+    ])
+    assert after_run - before_run < 20
+    xml = testdir.tmpdir.join('junit.xml').read()
+    assert 'errors="1"' in xml
+    assert 'Timeout: the test ran longer than 1.0s' in xml
+
+
+@pytest.mark.skipif(sys.platform == 'win32',
+                    reason="does not run on windows")
+def test_timeout_escalates_to_sigkill(testdir):
+    """Make sure that a worker ignoring SIGTERM is killed and replaced."""
+
+    testdir.makepyfile("""
+        import signal
+        import time
+
+        def test_stubborn():
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+            time.sleep(60)
+
+        def test_after():
+            pass
+    """)
+
+    before_run = time.time()
+    result = testdir.runpytest_subprocess('--concmode=mproc', '--concworkers=1', '--conctimeout=1')
+    after_run = time.time()
+
+    result.stdout.fnmatch_lines([
+        '*1 passed, 1 error*'
+    ])
+    assert after_run - before_run < 20
+
+
+@pytest.mark.skipif(sys.platform == 'win32',
+                    reason="does not run on windows")
+@pytest.mark.parametrize('stop', ['conctimeout', 'crash'])
+def test_worker_lost_within_batch(testdir, stop):
+    """Make sure that the items of a batch which were reported before its worker was lost do not run again."""
+
+    testdir.makepyfile("""
+        import os
+        import time
+        import pytest
+
+        def log(name):
+            with open('runs.txt', 'a') as runs:
+                runs.write(name + '\\n')
+
+        @pytest.fixture(scope='module')
+        def resource():
+            return 1
+
+        def test_first(resource):
+            log('first')
+            assert False
+
+        @pytest.mark.conctimeout(1)
+        def test_lost(resource):
+            log('lost')
+            if '%s' == 'crash':
+                os._exit(1)
+            time.sleep(60)
+
+        @pytest.mark.parametrize('para', range(4))
+        def test_rest(resource, para):
+            log('rest')
+    """ % stop)
+
+    result = testdir.runpytest_subprocess('--concmode=mproc', '--concworkers=1', '--concbatch')
+
+    result.stdout.fnmatch_lines([
+        '*1 failed, 4 passed, 1 error*'
+    ])
+    assert result.ret == 1
+    assert sorted(testdir.tmpdir.join('runs.txt').read().split()) == ['first', 'lost'] + ['rest'] * 4
+
+
+@pytest.mark.parametrize('mode', [None, 'mthread'])
+def test_timeout_keeps_protocol_hook_wrappers(testdir, mode):
+    """Make sure that an item with a timeout still runs within the pytest_runtest_protocol wrappers (filterwarnings)."""
+
+    testdir.makepyfile("""
+        import warnings
+        import pytest
+
+        @pytest.mark.conctimeout(10)
+        @pytest.mark.filterwarnings('error')
+        def test_warns():
+            warnings.warn(UserWarning('turned into an error'))
+
+        @pytest.mark.conctimeout(10)
+        def test_other():
+            pass
+    """)
+
+    result = testdir.runpytest(*(['--concmode=%s' % mode] if mode else []))
+
+    result.stdout.fnmatch_lines([
+        '*UserWarning: turned into an error*',
+        '*1 failed, 1 passed*'
+    ])
+
+
+@pytest.mark.parametrize('mode', [None, 'mthread'])
+def test_timeout_protocol_raises(testdir, mode):
+    """Make sure that an item with a timeout whose test protocol raised is reported as an error."""
+
+    testdir.makeconftest("""
+        import pytest
+
+        @pytest.hookimpl(hookwrapper=True)
+        def pytest_runtest_protocol(item):
+            if item.name == 'test_broken':
+                raise RuntimeError('the protocol broke')
+            yield
+    """)
+    testdir.makepyfile("""
+        import pytest
+
+        @pytest.mark.conctimeout(10)
+        def test_broken():
+            pass
+
+        @pytest.mark.conctimeout(10)
+        def test_other():
+            pass
+    """)
+
+    result = testdir.runpytest(*(['--concmode=%s' % mode] if mode else []))
+
+    result.stdout.fnmatch_lines([
+        '*RuntimeError: the protocol broke*',
+        '*1 passed, 1 error*'
+    ])
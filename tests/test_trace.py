@@ -0,0 +1,42 @@
+import sys
+import json
+import pytest
+
+
+@pytest.mark.skipif(sys.platform == 'win32',
+                    reason="does not run on windows")
+@pytest.mark.parametrize('mode', ['mthread', 'mproc'])
+def test_trace_per_phase_worker_and_group(testdir, mode):
+    """Make sure that --conctrace writes every phase of every test on the worker which ran it."""
+
+    testdir.makepyfile("""
+        import time
+        import pytest
+
+        @pytest.mark.concgroup(1)
+        @pytest.mark.parametrize('para', range(4))
+        def test_first(para):
+            time.sleep(0.2)
+
+        @pytest.mark.parametrize('para', range(4))
+        def test_second(para):
+            time.sleep(0.2)
+    """)
+
+    result = testdir.runpytest('--concmode=%s' % mode, '--concworkers=2', '--conctrace=trace.json')
+
+    result.stdout.fnmatch_lines([
+        '*concurrent trace*',
+        'trace written to trace.json',
+        '2 workers busy *s in *s, parallel efficiency *%',
+        'group 1: 4 items in *s',
+        'group ungrouped: 4 items in *s',
+        '*8 passed*'
+    ])
+    events = json.loads(testdir.tmpdir.join('trace.json').read())['traceEvents']
+    phases = [event for event in events if event['ph'] == 'X' and event['cat'] != 'group']
+    assert sorted(event['cat'] for event in phases) == ['call'] * 8 + ['setup'] * 8 + ['teardown'] * 8
+    assert len(set((event['pid'], event['tid']) for event in phases)) == 2
+    groups = dict((event['name'], event) for event in events if event.get('cat') == 'group')
+    assert groups['1']['ts'] + groups['1']['dur'] <= groups['ungrouped']['ts'] + 1
+    assert all(event['args']['group'] == ('1' if 'test_first' in event['name'] else 'ungrouped') for event in phases)